@@ -16,6 +16,7 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
+import os
 import bpy
 from . import shared
 from . import m3_bone
@@ -80,6 +81,8 @@ class M3ImportOperator(bpy.types.Operator):
     get_effects: bpy.props.BoolProperty(default=False, name='Effects', description='Imports effect data, such as particle systems or ribbons, and their associated materials. Applies only to m3 (not m3a) import')
     get_rig: bpy.props.BoolProperty(default=False, name='Rig', description='Imports bones and various bone related data. (Attachment points, hit test volumes, etc.) Applies only to m3 (not m3a) import')
     get_anims: bpy.props.BoolProperty(default=False, name='Animations', description='Imports animation data. Applies only to m3 (not m3a) import')
+    profile: bpy.props.BoolProperty(default=False, name='Report Statistics', description='Reports the time, memory and data created by each stage of the import')
+    use_cache: bpy.props.BoolProperty(default=False, name='Use Cache', description='Stores the decoded file along with processed mesh and animation data on disk, so that importing the same file with the same options again only needs to create the Blender data. Applies only to m3 (not m3a) import')
 
     def draw(self, context):
         layout = self.layout
@@ -95,6 +98,9 @@ class M3ImportOperator(bpy.types.Operator):
             row = col.row()
             row.active = self.get_rig
             row.prop(self, 'get_anims')
+        layout.separator()
+        layout.prop(self, 'use_cache')
+        layout.prop(self, 'profile')
 
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
@@ -102,7 +108,30 @@ class M3ImportOperator(bpy.types.Operator):
 
     def execute(self, context):
         opts = (self.get_rig, self.get_anims, self.get_mesh, self.get_effects)
-        io_m3_import.m3_import(filepath=self.filepath, ob=bpy.data.objects.get(self.id_name), bl_op=self, opts=opts)
+        cache = io_m3_import.ImportCache() if self.use_cache else None
+        io_m3_import.m3_import(filepath=self.filepath, ob=bpy.data.objects.get(self.id_name), bl_op=self, opts=opts, profile=self.profile, cache=cache)
+        return {'FINISHED'}
+
+
+class M3ImportBatchOperator(bpy.types.Operator):
+    '''Load multiple M3 files, each into a new armature'''
+    bl_idname = 'm3.import_batch'
+    bl_label = 'Import M3 (Batch)'
+    bl_options = {'UNDO'}
+
+    filename_ext = '.m3'
+    filter_glob: bpy.props.StringProperty(options={'HIDDEN'}, default='*.m3')
+    files: bpy.props.CollectionProperty(type=bpy.types.OperatorFileListElement, options={'HIDDEN', 'SKIP_SAVE'})
+    directory: bpy.props.StringProperty(subtype='DIR_PATH', options={'HIDDEN', 'SKIP_SAVE'})
+    max_workers: bpy.props.IntProperty(default=0, min=0, name='Worker Processes', description='Number of processes used to read the m3 files. When 0, the number of processors on the machine is used')
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        filepaths = [os.path.join(self.directory, file.name) for file in self.files]
+        io_m3_import.m3_import_batch(filepaths=filepaths, bl_op=self, max_workers=self.max_workers or None)
         return {'FINISHED'}
 
 
@@ -123,6 +152,11 @@ class M3ExportOperator(bpy.types.Operator):
     cull_unused_bones: bpy.props.BoolProperty(default=True, name='Cull Unused Bones', description='Bones which the exporter determines will not be referenced in the m3 file are removed')
     cull_material_layers: bpy.props.BoolProperty(default=True, name='Cull Material Layers', description='Fills all blank material layer slots with a reference to a single layer section, which reduces file size. When turned off, output will conform to Blizzard standards, where all available material layer slots are filled with a unique layer section.')
     use_only_max_bounds: bpy.props.BoolProperty(default=False, name='Use Only Max Bounds', description='Rather than having multiple bounding box keys, animations will have exactly one bounding box key which has the maximum dimensions of all the keys there would have been. Can slightly reduce file size')
+    smooth_tangents: bpy.props.BoolProperty(default=False, name='Smooth Tangents', description='Tangents of vertices are averaged from all of the faces which share them and made perpendicular to the vertex normal, rather than being taken from a single face. Can improve the shading of normal maps on curved surfaces')
+    sample_fcurves: bpy.props.BoolProperty(default=False, name='Sample F-Curves', description='Bone animations are read directly from the f-curves of each action rather than by evaluating the scene on every frame, which is much faster. Bones which have constraints or drivers, are part of an inverse kinematics chain, are connected, do not use quaternion rotation or do not fully inherit the transform of their parent are still evaluated through the scene')
+    anim_error_location: bpy.props.FloatProperty(default=0.0005, min=0, precision=4, name='Location Error', description='Bone animation keys are removed where the location can be interpolated from the remaining keys without differing by more than this distance. Keyframes set by the user are always kept')
+    anim_error_rotation: bpy.props.FloatProperty(default=0.0002, min=0, precision=4, subtype='ANGLE', name='Rotation Error', description='Bone animation keys are removed where the rotation can be interpolated from the remaining keys without differing by more than this angle. Keyframes set by the user are always kept')
+    anim_error_scale: bpy.props.FloatProperty(default=0.0005, min=0, precision=4, name='Scale Error', description='Bone animation keys are removed where the scale can be interpolated from the remaining keys without differing by more than this amount. Keyframes set by the user are always kept')
 
     @classmethod
     def poll(cls, context):
@@ -149,6 +183,7 @@ class M3ExportOperator(bpy.types.Operator):
 
 def top_bar_import(self, context):
     self.layout.operator('m3.import', text='StarCraft 2 Model (.m3)')
+    self.layout.operator('m3.import_batch', text='StarCraft 2 Models, Batch (.m3)')
 
 
 def top_bar_export(self, context):
@@ -197,6 +232,7 @@ classes = (
     *shared.classes,
     *m3_module_classes(),
     M3ImportOperator,
+    M3ImportBatchOperator,
     M3ExportOperator,
 )
 
@@ -215,6 +251,14 @@ def register():
     bpy.app.handlers.load_post.append(m3_attachmentpoints.attachment_name_list_verify)
     # for backwards compatibility with the names of attachment points from previous importer versions
     bpy.app.handlers.load_post.append(m3_attachmentpoints.attachmentpoint_names_fix)
+    # cached handle lookups refer to collection indices which may not be valid in the loaded or restored data
+    bpy.app.handlers.load_post.append(shared.m3_handle_indices_invalidate)
+    bpy.app.handlers.undo_post.append(shared.m3_handle_indices_invalidate)
+    bpy.app.handlers.redo_post.append(shared.m3_handle_indices_invalidate)
+    # cached animation id paths refer to collection items which may not exist in the loaded or restored data
+    bpy.app.handlers.load_post.append(shared.m3_collections_changed)
+    bpy.app.handlers.undo_post.append(shared.m3_collections_changed)
+    bpy.app.handlers.redo_post.append(shared.m3_collections_changed)
 
 
 def unregister():
@@ -20,7 +20,9 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import struct
+import io
 import copy
+import pickle
 from os import path
 from sys import stderr
 from xml.etree import ElementTree as ET
@@ -132,7 +134,7 @@ class M3StructureHistory:
                     stderr.write(f'{offset}: {fields[field].name}\n')
                     offset += fields[field].size
                 raise Exception(f'Size mismatch: {self.name}V{version} specified={spec_size} calculated={calc_size}')
-            self.version_to_description[desc_id] = (desc := M3StructureDescription(self, version, fields, calc_size))
+            self.version_to_description[desc_id] = (desc := M3StructureDescription(self, version, fields, calc_size, md_version))
 
         return desc
 
@@ -267,15 +269,20 @@ class M3StructureDescription:
 
         return M3StructureHistory('VertexFormat'+hex(vertex_flags).zfill(8), {0: size}, fields).get_version(0)
 
-    def __init__(self, history: M3StructureHistory, version, fields, size):
+    def __init__(self, history: M3StructureHistory, version, fields, size, md_version=34):
         self.history = history
         self.version = version
         self.fields = fields
         self.size = size
+        self.md_version = md_version
 
     def __str__(self):
         return f'{self.history.name}V{self.version}: {{{self.fields}}}'
 
+    def __reduce__(self):
+        # descriptions are shared, so only what is needed to look them up again is pickled
+        return (structure_description_get, (self.history.name, self.version, self.md_version))
+
     def instance(self, buffer=None, offset=0):
         return M3StructureData(self, buffer, offset)
 
@@ -474,6 +481,15 @@ class M3FieldFloat(M3FieldPrimitive):
             raise Exception(f'{field_path} {field_content} type is {type(field_content)}, not float')
 
 
+class M3SectionUnpickler(pickle.Unpickler):
+    ''' Resolves pickled io_m3 classes to this module, regardless of the name it was imported under '''
+
+    def find_class(self, module, name):
+        if module.rsplit('.', 1)[-1] == 'io_m3':
+            return globals()[name]
+        return super().find_class(module, name)
+
+
 class M3SectionList(list):
     ''' List object for M3Section instances '''
 
@@ -483,6 +499,8 @@ class M3SectionList(list):
         self.file = None
         self.model = None
         self.md_version = 34
+        self.placements_before = {}
+        self.placements_after = {}
 
     def __getitem__(self, key):
         if type(key) == M3StructureData:
@@ -496,6 +514,12 @@ class M3SectionList(list):
 
         return item
 
+    def __getstate__(self):
+        # the file handle of a lazy load is not pickled, it is reopened from filepath when a section is next read
+        state = self.__dict__.copy()
+        state['file'] = None
+        return state
+
     def __setitem__(self, item, val):
         assert type(val.desc) == M3StructureDescription
         return super(M3SectionList, self).__setitem__(item, val)
@@ -552,6 +576,20 @@ class M3SectionList(list):
 
         return self
 
+    @classmethod
+    def from_pickled(cls, buffer):
+        return M3SectionUnpickler(io.BytesIO(buffer)).load()
+
+    def discard(self, index):
+        # sections of a lazy load are freed and decoded again if accessed later
+        if getattr(self, 'index_entries', None) and index:
+            list.__setitem__(self, index, None)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
     def save(self, filepath=None):
         buffer_offset = 0
         for section in self:
@@ -586,6 +624,8 @@ class M3SectionList(list):
     def section_from_index_entry(self, index_entry):
         tag_str = index_entry.tag.to_bytes(4, 'little').decode('ascii').replace('\x00', '')[::-1]
         desc = structures[tag_str].get_version(index_entry.version, self.md_version)
+        if self.file is None:
+            self.file = open(self.filepath, 'rb')
         self.file.seek(index_entry.offset)
         section_buffer = self.file.read(index_entry.repetitions * desc.size)
         section = M3Section(desc=desc, index_entry=index_entry, references=[], content=desc.instances(buffer=section_buffer, count=index_entry.repetitions))
@@ -601,6 +641,36 @@ class M3SectionList(list):
 
         return section
 
+    def place_before(self, anchor, *sections):
+        # sections are positioned relative to the anchor section when the list is laid out, in the order they are placed
+        self.placements_before.setdefault(anchor, []).extend(sections)
+
+    def place_after(self, anchor, *sections):
+        self.placements_after.setdefault(anchor, []).extend(sections)
+
+    def layout(self):
+        # produces the final order of placed sections in a single pass, placed sections may themselves be anchors
+        if not self.placements_before and not self.placements_after:
+            return
+
+        sections = []
+
+        def section_emit(section):
+            for placed_section in self.placements_before.pop(section, ()):
+                section_emit(placed_section)
+            sections.append(section)
+            for placed_section in self.placements_after.pop(section, ()):
+                section_emit(placed_section)
+
+        for section in list.__iter__(self):
+            section_emit(section)
+
+        if self.placements_before or self.placements_after:
+            raise Exception('Cannot place sections relative to a section which is not in the section list')
+
+        self.clear()
+        self.extend(sections)
+
     def validate(self):
         culled_sections = 0
         for ii in range(len(self)):
@@ -750,4 +820,8 @@ class M3Section:
         self.content = [ord(c) for c in string] + [0x00]
 
 
+def structure_description_get(name, version, md_version=34):
+    return structures[name].get_version(version, md_version)
+
+
 structures = structures_from_tree()
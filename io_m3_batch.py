@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# parts of the import which do not depend on blender, used by the importer and by the worker processes of batch imports
+# worker processes load this module from its file under a private name (see io_m3_import.m3_import_batch), since they cannot import the add-on package
+
+import os
+import sys
+import importlib.util
+import numpy as np
+
+
+def module_load(name, filepath):
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(name, filepath)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+if __package__:
+    from . import io_m3
+else:
+    io_m3 = module_load('_m3studio_io_m3', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'io_m3.py'))
+
+
+# functions submitted to worker processes are pickled by reference to the module name they were registered under
+worker_module_name = '_m3studio_io_m3_batch'
+# name under which worker processes run this file when they start, see worker_init
+worker_init_run_name = '_m3studio_io_m3_batch_init'
+
+FRAME_RATE = 30
+
+
+def to_bl_frame(m3_ms):
+    return round(m3_ms / 1000 * FRAME_RATE)
+
+
+def m3_key_collect_evnt(key_frames, key_values):
+    pass  # handle these specially
+
+
+def m3_key_collect_real(key_frames, key_values):
+    ll = ([],)
+
+    for key_frame, key_value in zip(key_frames, key_values):
+        ll[0].extend((key_frame, key_value))
+
+    return ll
+
+
+def m3_key_collect_vec2(key_frames, key_values):
+    ll = ([], [])
+
+    for key_frame, key_value in zip(key_frames, key_values):
+        ll[0].extend((key_frame, key_value.x))
+        ll[1].extend((key_frame, key_value.y))
+
+    return ll
+
+
+def m3_key_collect_vec3(key_frames, key_values):
+    ll = ([], [], [])
+
+    for key_frame, key_value in zip(key_frames, key_values):
+        ll[0].extend((key_frame, key_value.x))
+        ll[1].extend((key_frame, key_value.y))
+        ll[2].extend((key_frame, key_value.z))
+
+    return ll
+
+
+def m3_key_collect_quat(key_frames, key_values):
+    ll = ([], [], [], [])
+
+    for key_frame, key_value in zip(key_frames, key_values):
+        ll[0].extend((key_frame, key_value.w))
+        ll[1].extend((key_frame, key_value.x))
+        ll[2].extend((key_frame, key_value.y))
+        ll[3].extend((key_frame, key_value.z))
+
+    return ll
+
+
+def m3_key_collect_colo(key_frames, key_values):
+    ll = ([], [], [], [])
+
+    for key_frame, key_value in zip(key_frames, key_values):
+        ll[0].append(key_frame)
+        ll[0].append(key_value.r / 255)
+        ll[1].append(key_frame)
+        ll[1].append(key_value.g / 255)
+        ll[2].append(key_frame)
+        ll[2].append(key_value.b / 255)
+        ll[3].append(key_frame)
+        ll[3].append(key_value.a / 255)
+
+    return ll
+
+
+def m3_key_collect_bnds(key_frames, key_values):
+    pass  # handle these specially
+
+
+m3_key_type_collection_method = [
+    m3_key_collect_evnt, m3_key_collect_vec2, m3_key_collect_vec3, m3_key_collect_quat, m3_key_collect_colo, m3_key_collect_real, m3_key_collect_real,
+    m3_key_collect_real, m3_key_collect_real, m3_key_collect_real, m3_key_collect_real, m3_key_collect_real, m3_key_collect_bnds,
+]
+
+
+
+def np_dtype_from_desc(desc):
+    # structured array type with the memory layout of the m3 structure description
+    fields = []
+    for field in desc.fields.values():
+        if type(field) == io_m3.M3FieldStructure:
+            fields.append((field.name, np_dtype_from_desc(field.desc)))
+        else:
+            fields.append((field.name, field.struct_format.format))
+    dtype = np.dtype(fields)
+    assert dtype.itemsize == desc.size
+    return dtype
+
+
+def vertex_lookup_weight_fields(dtype):
+    return [name for name in dtype.names if name.startswith(('lookup', 'weight'))]
+
+
+def vertices_dedup(vertices):
+    # vertices are identified by their position, normal and bone weights, in the order of their first occurrence
+    # returns the index of the first vertex of each identity and the identity index of each vertex
+    key_fields = [name for name in ('pos', 'normal') if name in vertices.dtype.names] + vertex_lookup_weight_fields(vertices.dtype)
+    keys = np.zeros(len(vertices), dtype=[(field, vertices.dtype[field]) for field in key_fields])
+    for field in key_fields:
+        keys[field] = vertices[field]
+
+    # negative zero compares equal to zero, but not as bytes
+    for axis in 'xyz':
+        keys['pos'][axis] += 0.0
+
+    keys = keys.view(np.dtype((np.void, keys.dtype.itemsize)))
+    unique_first, unique_inverse = np.unique(keys, return_index=True, return_inverse=True)[1:]
+    unique_order = np.argsort(unique_first, kind='stable')
+    unique_ranks = np.empty_like(unique_order)
+    unique_ranks[unique_order] = np.arange(len(unique_order))
+
+    return unique_first[unique_order], unique_ranks[unique_inverse.ravel()]
+
+
+def regions_prepare(m3, model, division):
+    # vertices and faces of each region which has batches, with faces indexing the vertices of their region
+    # returns {region index: (vertices, faces, deduplicated vertex indices, vertex to deduplicated vertex map)}
+    vertex_section = m3[model.vertices]
+    vertex_desc = io_m3.M3StructureDescription.get_vertex_description(model.vertex_flags)
+    vertices = np.frombuffer(vertex_section.raw_bytes, dtype=np_dtype_from_desc(vertex_desc), count=len(vertex_section) // vertex_desc.size)
+    face_section = m3[division.faces]
+    faces = np.frombuffer(face_section.raw_bytes, dtype='<u2', count=len(face_section)).astype(np.int64)
+
+    batch_region_indices = set(batch.region_index for batch in m3[division.batches])
+
+    regions = {}
+    for region_ii, region in enumerate(m3[division.regions]):
+        if region_ii not in batch_region_indices:
+            continue
+
+        regn_vertices = vertices[region.first_vertex_index:region.first_vertex_index + region.vertex_count].copy()
+        regn_faces = faces[region.first_face_index:region.first_face_index + region.face_count].copy()
+
+        if region.desc.version <= 2:
+            regn_faces -= region.first_vertex_index
+
+        regions[region_ii] = (regn_vertices, regn_faces, *vertices_dedup(regn_vertices))
+
+    return regions
+
+
+def stc_key_type_collections(stc):
+    # key type collections of a sequence transformation collection, in the order of the key type of animation references
+    return [stc.sdev, stc.sd2v, stc.sd3v, stc.sd4q, stc.sdcc, stc.sdr3, stc.sdu8, stc.sds6, stc.sdu6, stc.sds3, stc.sdu3, stc.sdfg, stc.sdmb]
+
+
+def anim_keys_get(m3, key_entries):
+    # of keys sharing a frame, only the last is kept
+    frames = []
+    ignored_indices = []
+    for ii, ms in enumerate(m3[key_entries.frames]):
+        frame = to_bl_frame(ms)
+        if frame not in frames:
+            frames.append(frame)
+        else:
+            frames[-1] = frame
+            ignored_indices.append(ii - 1)
+
+    m3_keys = m3[key_entries.keys]
+    keys = [m3_keys[ii] for ii in range(len(m3_keys)) if ii not in ignored_indices]
+
+    return frames, keys
+
+
+def anim_keys_prepare(m3, model):
+    # collected keys of each animation reference of the named sequence transformation collections, except for events
+    # returns {(stc index, animation reference): collected keys}
+    anim_keys = {}
+    for stc_index, stc in enumerate(m3[model.sequence_transformation_collections]):
+        if not stc.name.index:
+            continue
+
+        key_type_collections = stc_key_type_collections(stc)
+        for stc_ref in m3[stc.anim_refs]:
+            anim_type = stc_ref >> 16
+            # the names of event keys are read along with them by the importer
+            if anim_type == 0:
+                continue
+
+            key_entries = m3[key_type_collections[anim_type]][stc_ref & 0xffff]
+            anim_keys[(stc_index, stc_ref)] = m3_key_type_collection_method[anim_type](*anim_keys_get(m3, key_entries))
+
+    return anim_keys
+
+
+def file_preprocess(filepath):
+    # run by worker processes, returning only arrays and lists so that the section list is not passed back to the caller
+    m3 = io_m3.M3SectionList.load(filepath, lazy=True)
+    try:
+        divisions = m3[m3.model.divisions]
+        has_regions = divisions and divisions[0].regions.index and divisions[0].regions.entries
+        regions = regions_prepare(m3, m3.model, divisions[0]) if has_regions else {}
+        return regions, anim_keys_prepare(m3, m3.model)
+    finally:
+        m3.close()
+
+
+def worker_init():
+    module_load(worker_module_name, os.path.abspath(__file__))
+
+
+# worker processes are spawned, so that their initializer is pickled by reference as well
+# since this module cannot be imported by name before it is registered, workers run this file with runpy.run_path instead
+if __name__ == worker_init_run_name:
+    worker_init()
@@ -22,11 +22,13 @@ import mathutils
 import os
 import traceback
 import math
+import numpy as np
 from . import bl_enum
 from . import io_m3
 from . import io_shared
 from . import shared
 from .m3_animations import ob_anim_data_set
+from .io_m3_batch import np_dtype_from_desc
 
 
 ANIM_DATA_SECTION_NAMES = ('SDEV', 'SD2V', 'SD3V', 'SD4Q', 'SDCC', 'SDR3', 'SDU8', 'SDS6', 'SDU6', 'SDS3', 'SDU3', 'SDFG', 'SDMB')
@@ -34,6 +36,8 @@ BNDS_ANIM_ID = 0x001f9bd2
 EVNT_ANIM_ID = 0x65bd3215
 INT16_MIN = (-(1 << 15))
 INT16_MAX = ((1 << 15) - 1)
+# since blender 3.2, color gives scene linear values, while the importer writes the stored byte values as they are
+VERTEX_COLOR_PROP = 'color' if (3, 2, 0) > bpy.app.version else 'color_srgb'
 
 
 def to_m3_ms(bl_frame):
@@ -69,6 +73,40 @@ def to_m3_vec3_uint8(bl_vec=None):
     return m3_vec
 
 
+def to_np_vec3_uint8(bl_vecs):
+    # array equivalent of to_m3_vec3_uint8
+    return np.clip(np.round((np.asarray(bl_vecs, dtype=np.float64) + 1) / 2 * 255), 0, 255).astype(np.uint8)
+
+
+def to_np_uv(bl_uvs):
+    # array equivalent of to_m3_uv
+    bl_uvs = np.asarray(bl_uvs, dtype=np.float64)
+    return np.clip(np.round(np.stack((bl_uvs[:, 0], -bl_uvs[:, 1] + 1.0), axis=1) * 2048), INT16_MIN, INT16_MAX).astype(np.int16)
+
+
+def np_normalized(vecs):
+    # rows of zero length are left as zero vectors, like mathutils.Vector.normalized
+    lengths = np.linalg.norm(vecs, axis=-1, keepdims=True)
+    return np.divide(vecs, lengths, out=np.zeros_like(vecs), where=lengths > 0)
+
+
+def np_tri_tangents(tri_cos, tri_uvs):
+    # unit tangents and bitangent signs of triangles, from arrays of their loop positions and uvs
+    edges1 = tri_cos[:, 1] - tri_cos[:, 0]
+    edges2 = tri_cos[:, 2] - tri_cos[:, 0]
+    du1, dv1 = (tri_uvs[:, 1] - tri_uvs[:, 0]).T
+    du2, dv2 = (tri_uvs[:, 2] - tri_uvs[:, 0]).T
+    d = dv1 * du2 - du1 * dv2
+    tans = (dv2[:, None] * edges1 - dv1[:, None] * edges2) * -np.sign(d)[:, None]
+    return np_normalized(tans), np.where(d < 0, 0, 255).astype(np.uint8)
+
+
+def np_tri_corner_angles(tri_cos):
+    edges_next = np.roll(tri_cos, -1, axis=1) - tri_cos
+    edges_prev = np.roll(tri_cos, 1, axis=1) - tri_cos
+    return np.arctan2(np.linalg.norm(np.cross(edges_next, edges_prev), axis=-1), (edges_next * edges_prev).sum(axis=-1))
+
+
 def to_m3_vec4(bl_vec=None):
     m3_vec = io_m3.structures['VEC4'].get_version(0).instance()
     m3_vec.x, m3_vec.y, m3_vec.z, m3_vec.w = bl_vec or (0.0, 0.0, 0.0, 0.0)
@@ -125,130 +163,222 @@ def bind_scale_to_matrix(vec3):
 
 
 ANIM_VEC_DATA_SETTINGS = {
-    'SD2V': {'length': 2, 'convert': to_m3_vec2, 'attr': ['x', 'y']},
-    'SD3V': {'length': 3, 'convert': to_m3_vec3, 'attr': ['x', 'y', 'z']},
-    'SDCC': {'length': 4, 'convert': to_m3_color, 'attr': ['r', 'g', 'b', 'a']},
+    'SD2V': {'length': 2, 'convert': to_m3_vec2},
+    'SD3V': {'length': 3, 'convert': to_m3_vec3},
+    'SDCC': {'length': 4, 'convert': to_m3_color},
 }
 
 
-def get_fcurve_anim_frames(fcurve, interpolation='LINEAR'):
-    if fcurve is None or not len(fcurve.keyframe_points):
-        return
-
-    frames = []
+# values of keyframe interpolation modes as given by foreach_get
+KEYFRAME_INTERPOLATION_VALUES = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2}
 
-    last_interp = interpolation
-    last_frame = round(fcurve.keyframe_points[0].co.x)
-    for point in fcurve.keyframe_points:
-        frame = round(point.co.x)
-        if last_interp != interpolation and last_interp != 'CONSTANT':
-            for f in range(last_frame, frame):
-                frames.append(f)
-        last_interp = point.interpolation
-        last_frame = round(point.co.x)
-        frames.append(frame)
 
-    return frames
+def fcurve_keyframes_get(fcurve):
+    count = len(fcurve.keyframe_points)
+    coords = np.empty(count * 2, dtype=np.float32)
+    fcurve.keyframe_points.foreach_get('co', coords)
+    interps = np.empty(count, dtype=np.int32)
+    fcurve.keyframe_points.foreach_get('interpolation', interps)
+    return coords.reshape(-1, 2).astype(np.float64), interps
 
 
-def quats_compatibility(quats):
-    if len(quats) < 2:
+def get_fcurve_anim_frames(fcurve, interpolation='LINEAR'):
+    if fcurve is None or not len(fcurve.keyframe_points):
         return
 
-    prev_quat = quats[0]
-    for quat in quats[1:]:
-        quat.make_compatible(prev_quat)
-        prev_quat = quat
-
-
-def float_interp(left, right, factor):
-    return left * (1 - factor) + right * factor
-
+    coords, interps = fcurve_keyframes_get(fcurve)
+    frames = np.round(coords[:, 0]).astype(np.int64)
+
+    # every frame of segments which are neither constant nor of the given interpolation is included
+    expand = (interps[:-1] != KEYFRAME_INTERPOLATION_VALUES[interpolation]) & (interps[:-1] != KEYFRAME_INTERPOLATION_VALUES['CONSTANT'])
+    starts = frames[:-1][expand]
+    lengths = np.maximum(frames[1:][expand] - starts, 0)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    return np.unique(np.concatenate((frames, np.repeat(starts, lengths) + offsets))).tolist()
+
+
+def sample_fcurve(fcurve, frames):
+    # values of the fcurve at the given frames, constant and linear segments are interpolated as arrays
+    # other segments, modifiers and extrapolation are left to fcurve.evaluate
+    frames = np.asarray(frames, dtype=np.float64)
+    if fcurve.modifiers or fcurve.extrapolation != 'CONSTANT' or not len(fcurve.keyframe_points):
+        return np.array([fcurve.evaluate(frame) for frame in frames.tolist()], dtype=np.float64)
+
+    coords, interps = fcurve_keyframes_get(fcurve)
+    xs, ys = coords.T
+    lefts = np.clip(np.searchsorted(xs, frames, side='right') - 1, 0, len(xs) - 1)
+    rights = np.minimum(lefts + 1, len(xs) - 1)
+    inner = (frames > xs[0]) & (frames < xs[-1])
+
+    spans = xs[rights] - xs[lefts]
+    factors = np.divide(frames - xs[lefts], spans, out=np.zeros_like(frames), where=spans > 0)
+    values = np.where(inner & (interps[lefts] == KEYFRAME_INTERPOLATION_VALUES['LINEAR']), ys[lefts] + (ys[rights] - ys[lefts]) * factors, ys[lefts])
+    values[frames <= xs[0]] = ys[0]
+
+    evaluated = np.flatnonzero(inner & (interps[lefts] != KEYFRAME_INTERPOLATION_VALUES['LINEAR']) & (interps[lefts] != KEYFRAME_INTERPOLATION_VALUES['CONSTANT']))
+    values[evaluated] = [fcurve.evaluate(frame) for frame in frames[evaluated].tolist()]
+    return values
+
+
+def np_loc_rot_scale_matrices(locs, quats, scales):
+    # array equivalent of mathutils.Matrix.LocRotScale, quaternions are normalized like blender does for pose bones
+    w, x, y, z = np_normalized(quats).T
+    matrices = np.zeros((len(locs), 4, 4))
+    matrices[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    matrices[:, 0, 1] = 2 * (x * y - w * z)
+    matrices[:, 0, 2] = 2 * (x * z + w * y)
+    matrices[:, 1, 0] = 2 * (x * y + w * z)
+    matrices[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    matrices[:, 1, 2] = 2 * (y * z - w * x)
+    matrices[:, 2, 0] = 2 * (x * z - w * y)
+    matrices[:, 2, 1] = 2 * (y * z + w * x)
+    matrices[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    matrices[:, 0:3, 0:3] *= scales[:, None, :]
+    matrices[:, 0:3, 3] = locs
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+def np_matrices_to_quats(rots):
+    # quaternions of normalized rotation matrices, choosing the most numerically stable formula per matrix
+    m00, m01, m02 = rots[:, 0, 0], rots[:, 0, 1], rots[:, 0, 2]
+    m10, m11, m12 = rots[:, 1, 0], rots[:, 1, 1], rots[:, 1, 2]
+    m20, m21, m22 = rots[:, 2, 0], rots[:, 2, 1], rots[:, 2, 2]
+    trace = m00 + m11 + m22
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s0 = np.sqrt(np.maximum(1 + trace, 0)) * 2
+        s1 = np.sqrt(np.maximum(1 + m00 - m11 - m22, 0)) * 2
+        s2 = np.sqrt(np.maximum(1 - m00 + m11 - m22, 0)) * 2
+        s3 = np.sqrt(np.maximum(1 - m00 - m11 + m22, 0)) * 2
+        cases = np.stack((
+            np.stack((0.25 * s0, (m21 - m12) / s0, (m02 - m20) / s0, (m10 - m01) / s0), axis=1),
+            np.stack(((m21 - m12) / s1, 0.25 * s1, (m01 + m10) / s1, (m02 + m20) / s1), axis=1),
+            np.stack(((m02 - m20) / s2, (m01 + m10) / s2, 0.25 * s2, (m12 + m21) / s2), axis=1),
+            np.stack(((m10 - m01) / s3, (m02 + m20) / s3, (m12 + m21) / s3, 0.25 * s3), axis=1),
+        ))
+    case = np.argmax(np.stack((trace, m00, m11, m22), axis=1), axis=1)
+    quats = np_normalized(cases[case, np.arange(len(rots))])
+    # blender gives quaternions from matrices with a non-negative w
+    quats[quats[:, 0] < 0] *= -1
+    return quats
+
+
+def np_decompose_matrices(matrices):
+    # array equivalent of mathutils.Matrix.decompose, giving locations, quaternions (w, x, y, z) and scales
+    locs = matrices[:, 0:3, 3].copy()
+    rots = matrices[:, 0:3, 0:3]
+    scls = np.linalg.norm(rots, axis=1)
+    scls[np.linalg.det(rots) < 0] *= -1
+    rots = np.divide(rots, scls[:, None, :], out=np.zeros_like(rots), where=scls[:, None, :] != 0)
+    return locs, np_matrices_to_quats(rots), scls
+
+
+def sample_pose_bone_basis_matrices(action_fcurves, pose_bone, frames):
+    # evaluates the transform fcurves of the bone directly, channels without an fcurve keep their current value
+    channels = []
+    for prop, length in (('location', 3), ('rotation_quaternion', 4), ('scale', 3)):
+        data_path = pose_bone.path_from_id(prop)
+        vals = np.empty((len(frames), length))
+        for ii in range(length):
+            fcurve = action_fcurves.get((data_path, ii))
+            if fcurve and not fcurve.mute:
+                vals[:, ii] = sample_fcurve(fcurve, frames)
+            else:
+                vals[:, ii] = getattr(pose_bone, prop)[ii]
+        channels.append(vals)
+    return np_loc_rot_scale_matrices(*channels)
 
-def float_equal(val0, val1):
-    return abs(val0 - val1) < 0.0005
 
+def np_quats_compatibility(quats):
+    # array equivalent of making each quaternion compatible with the previous one
+    dots = (quats[1:] * quats[:-1]).sum(axis=1)
+    quats[1:] *= np.cumprod(np.where(dots < 0, -1, 1))[:, None]
+    return quats
 
-def vec_interp(left, right, factor):
-    return left.lerp(right, factor)
 
+def np_lerp(left, right, factors):
+    return left + (right - left) * factors[:, None]
 
-def vec_equal(val0, val1):
-    return (val0 - val1).length < 0.0005
 
+def np_slerp(left, right, factors):
+    dots = (left * right).sum(axis=1)
+    right = np.where(dots[:, None] < 0, -right, right)
+    angles = np.arccos(np.clip(np.abs(dots), 0, 1))
+    sins = np.sin(angles)
+    small = sins < 0.000001
+    sins[small] = 1
+    left_factors = np.where(small, 1 - factors, np.sin((1 - factors) * angles) / sins)
+    right_factors = np.where(small, factors, np.sin(factors * angles) / sins)
+    return np_normalized(left * left_factors[:, None] + right * right_factors[:, None])
 
-def quat_interp(left, right, factor):
-    return left.slerp(right, factor)
 
+def np_vec_errors(vals0, vals1):
+    return np.linalg.norm(vals0 - vals1, axis=1)
 
-def quat_equal(val0, val1):
-    dist = (val0.x - val1.x) ** 2 + (val0.y - val1.y) ** 2 + (val0.z - val1.z) ** 2 + (val0.w - val1.w) ** 2
-    return dist < 0.00000001
 
+def np_quat_errors(quats0, quats1):
+    # angle of the rotation between the quaternions
+    return 2 * np.arccos(np.clip(np.abs((quats0 * quats1).sum(axis=1)), 0, 1))
 
-def simplify_anim_data_with_interp(keys, keyframes, vals, interp_func, equal_func):
-    if len(vals) < 2:
-        return keys, vals
 
-    left_key, curr_key = keys[:2]
-    left_val, curr_val = vals[:2]
-    new_keys = [left_key]
-    new_vals = [left_val]
+def fcurves_keyframe_frames(fcurves):
+    frames = [np.empty(0)]
+    for fcurve in fcurves:
+        if fcurve:
+            coords = np.empty(len(fcurve.keyframe_points) * 2)
+            fcurve.keyframe_points.foreach_get('co', coords)
+            frames.append(coords[0::2])
+    return np.round(np.concatenate(frames))
 
-    for right_key, right_val in zip(keys[2:], vals[2:]):
 
-        # include key if it was manually set, even if it can be interpolated
-        if curr_key in keyframes:
-            new_keys.append(curr_key)
-            new_vals.append(curr_val)
-            left_key = curr_key
-            left_val = curr_val
-            curr_key = right_key
-            curr_val = right_val
-            continue
+def reduce_anim_keys(keys, vals, keyframes, tolerance, interp_func, error_func):
+    # returns the indices of the keys to keep so that interpolating between them strays from vals by no more than the tolerance
+    # every pass, the value which strays furthest beyond the tolerance within each interval of kept keys becomes a key
+    # the first and last keys are always kept, as are keys which were manually set
+    if len(keys) < 3:
+        return np.arange(len(keys))
 
-        interpolated_val = interp_func(left_val, right_val, (curr_key - left_key) / (right_key - left_key))
-        if equal_func(interpolated_val, curr_val):
-            pass  # ignore current value since since it matches the given interpolation
-        else:
-            new_keys.append(curr_key)
-            new_vals.append(curr_val)
-            left_key = curr_key
-            left_val = curr_val
-        curr_key = right_key
-        curr_val = right_val
+    key_indices = np.arange(len(keys))
+    kept = np.isin(keys, keyframes)
+    kept[[0, -1]] = True
 
-    new_keys.append(keys[-1])
-    new_vals.append(vals[-1])
+    while True:
+        kept_indices = np.flatnonzero(kept)
+        intervals = np.minimum(np.searchsorted(kept_indices, key_indices, side='right') - 1, len(kept_indices) - 2)
+        lefts = kept_indices[intervals]
+        rights = kept_indices[intervals + 1]
+        factors = (keys - keys[lefts]) / (keys[rights] - keys[lefts])
+        errors = error_func(interp_func(vals[lefts], vals[rights], factors), vals)
+        errors[kept] = 0
 
-    return new_keys, new_vals
+        order = np.lexsort((-errors, intervals))
+        worst = order[np.r_[True, intervals[order][1:] != intervals[order][:-1]]]
+        worst = worst[errors[worst] > tolerance]
+        if not len(worst):
+            return kept_indices
+        kept[worst] = True
 
 
-def vec_list_contains_not_only(vec_list, vec):
-    for v in vec_list:
-        if not vec_equal(v, vec):
-            return True
-    return False
+# selects the minimum or maximum of each axis for the 8 corners of a box
+BOX_CORNER_SELECT = np.array([[(ii >> jj) & 1 for jj in range(3)] for ii in range(8)], dtype=bool)
 
 
-def quat_list_contains_not_only(quat_list, quat):
-    for q in quat_list:
-        if not quat_equal(q, quat):
-            return True
-    return False
+def bounding_vectors_from_bones(bone_rest_bounds, bone_to_matrices):
+    # the corners of each bone's rest bounds are transformed by the bone's stacked matrices of every frame at once
+    # returns the minimum and maximum of all corners per frame
+    bones = list(bone_rest_bounds.keys())
+    bounds_min = np.array([bone_rest_bounds[bone][0] for bone in bones], dtype=np.float64).reshape(-1, 3)
+    bounds_max = np.array([bone_rest_bounds[bone][1] for bone in bones], dtype=np.float64).reshape(-1, 3)
+    corners = np.where(BOX_CORNER_SELECT[None], bounds_max[:, None], bounds_min[:, None])
+    matrices = np.array([bone_to_matrices[bone] for bone in bones], dtype=np.float64).reshape(len(bones), -1, 4, 4)
+    points = np.einsum('bfij,bcj->bfci', matrices[:, :, 0:3, 0:3], corners) + matrices[:, :, None, 0:3, 3]
+    return points.min(axis=(0, 2)), points.max(axis=(0, 2))
 
 
-def bounding_vectors_from_bones(bone_rest_bounds, bone_to_matrix_dict):
-    vals = ([], [], [])
-    for bone, coords in bone_rest_bounds.items():
-        matrix = bone_to_matrix_dict[bone]
-        for co in coords:
-            mat_co = matrix @ co
-            vals[0].append(mat_co.x)
-            vals[1].append(mat_co.y)
-            vals[2].append(mat_co.z)
-
-    return mathutils.Vector(min(val) for val in vals), mathutils.Vector(max(val) for val in vals)
+def bounds_errors(bounds0, bounds1):
+    # bounds are given as rows of minimums followed by maximums
+    return np.maximum(np_vec_errors(bounds0[:, 0:3], bounds1[:, 0:3]), np_vec_errors(bounds0[:, 3:6], bounds1[:, 3:6]))
 
 
 class M3OutputProcessor:
@@ -265,8 +395,9 @@ class M3OutputProcessor:
         head.hex_id = head.hex_id  # set hex_id to itself to verify
 
         is_animated = False
-        for action in self.exporter.action_to_anim_data:
-            fcurve = action.fcurves.find(self.bl.path_from_id(field))
+        data_path = self.bl.path_from_id(field)
+        for action in self.exporter.data_path_actions.get(data_path, ()):
+            fcurve = self.exporter.action_fcurves[action].get((data_path, 0))
             frames = get_fcurve_anim_frames(fcurve)
 
             if not frames:
@@ -274,7 +405,7 @@ class M3OutputProcessor:
 
             is_animated = True
 
-            values = [type_ob(fcurve.evaluate(frame)) for frame in frames]
+            values = [type_ob(val) for val in sample_fcurve(fcurve, frames).tolist()]
             self.exporter.action_to_anim_data[action][anim_data_tag][int(head.hex_id, 16)] = (frames, values)
 
         return is_animated
@@ -285,20 +416,10 @@ class M3OutputProcessor:
 
         is_animated = False
         vec_data_settings = ANIM_VEC_DATA_SETTINGS[anim_data_tag]
-        for action in self.exporter.action_to_anim_data:
-            animated = False
-            fcurves = []
-            for ii in range(vec_data_settings['length']):
-                fcurve = action.fcurves.find(self.bl.path_from_id(field), index=ii)
-
-                if fcurve:
-                    fcurves.append(fcurve)
-                    animated = True
-                else:
-                    fcurves.append(None)
-
-            if not animated:
-                continue
+        data_path = self.bl.path_from_id(field)
+        for action in self.exporter.data_path_actions.get(data_path, ()):
+            action_fcurves = self.exporter.action_fcurves[action]
+            fcurves = [action_fcurves.get((data_path, ii)) for ii in range(vec_data_settings['length'])]
 
             frames = []
             for fcurve in fcurves:
@@ -316,17 +437,14 @@ class M3OutputProcessor:
 
             is_animated = True
 
-            values = []
-            for frame in frames:
-                vec_comps = []
-
-                for ii, fcurve in enumerate(fcurves):
-                    if fcurve is None:
-                        vec_comps.append(getattr(anim_ref.default, vec_data_settings['attr'][ii]))
-                    else:
-                        vec_comps.append(fcurve.evaluate(frame))
+            vec_comps = np.empty((len(frames), vec_data_settings['length']), dtype=np.float64)
+            for ii, fcurve in enumerate(fcurves):
+                if fcurve is None:
+                    vec_comps[:, ii] = getattr(self.bl, field)[ii]
+                else:
+                    vec_comps[:, ii] = sample_fcurve(fcurve, frames)
 
-                values.append(vec_data_settings['convert'](vec_comps))
+            values = [vec_data_settings['convert'](val) for val in vec_comps.tolist()]
 
             self.exporter.action_to_anim_data[action][anim_data_tag][int(head.hex_id, 16)] = (frames, values)
 
@@ -558,6 +676,28 @@ class Exporter():
                 arm_mod = sc_ob.modifiers.new('Armature', 'ARMATURE')
                 arm_mod.object = self.ob
 
+    def get_scene_evaluated_bones(self, bones):
+        # bones whose local pose matrix is not simply composed of their transform properties must be evaluated through the scene
+        if any(not track.mute for track in self.ob.animation_data.nla_tracks):
+            return set(bones)
+
+        driver_paths = [driver.data_path for driver in self.ob.animation_data.drivers]
+        evaluated_bones = set()
+        for pose_bone in bones:
+            bone = pose_bone.bone
+            bone_path = pose_bone.path_from_id()
+            if pose_bone.constraints or pose_bone.rotation_mode != 'QUATERNION' or bone.use_connect or not bone.use_inherit_rotation or bone.inherit_scale != 'FULL':
+                evaluated_bones.add(pose_bone)
+            elif any(driver_path.startswith(bone_path) for driver_path in driver_paths):
+                evaluated_bones.add(pose_bone)
+
+            for constraint in pose_bone.constraints:
+                if constraint.type in ['IK', 'SPLINE_IK']:
+                    chain_count = constraint.chain_count - 1 if constraint.chain_count else None
+                    evaluated_bones.update(pose_bone.parent_recursive[0:chain_count])
+
+        return evaluated_bones
+
     def op_report(self):
         if len(self.err_strings) or len(self.warn_strings):
             report_level = 'ERROR' if len(self.err_strings) else 'WARNING'
@@ -1123,6 +1263,7 @@ class Exporter():
 
         if self.bl_op.output_anims or self.is_m3a:
             self.create_sequences(model, valid_collections['sequences'])
+        self.create_fcurve_index()
         self.create_bones(model, valid_collections['bones'], valid_collections['sequences'])
         self.create_division(model, valid_collections['regions'], valid_collections['bones'], regn_version=self.ob.m3_mesh_version)
         self.create_attachment_points(model, valid_collections['attachment_points'])  # TODO should exclude attachments with same bone as other attachments
@@ -1150,6 +1291,7 @@ class Exporter():
         if self.bl_op.output_anims or self.is_m3a:
             self.finalize_anim_data(model)
 
+        self.m3.layout()
         self.m3.validate()
         self.m3.resolve()
 
@@ -1239,6 +1381,16 @@ class Exporter():
             self.m3.append(stg_name_section)
             self.m3.append(stg_indices_section)
 
+    def create_fcurve_index(self):
+        # maps each exported action to its fcurves by data path and index, and each data path to the actions which animate it
+        self.action_fcurves = {}
+        self.data_path_actions = {}
+        for action in self.action_to_anim_data:
+            fcurves = self.action_fcurves[action] = {}
+            for fcurve in action.fcurves:
+                fcurves[(fcurve.data_path, fcurve.array_index)] = fcurve
+                self.data_path_actions.setdefault(fcurve.data_path, {})[action] = None
+
     def finalize_anim_data(self, model):
         ids_sections = []  # for collecting anim_id sections to copy later
         stc_ids_section = {}
@@ -1253,39 +1405,19 @@ class Exporter():
                 self.action_to_anim_data[action]['SDMB'][BNDS_ANIM_ID] = [[], []]
                 bnds_data = self.action_to_anim_data[action]['SDMB'][BNDS_ANIM_ID]
 
-                frame_list = list(self.action_abs_pose_matrices[action].keys())
-                init_frame = frame_list.pop(0)
-
-                prev_min, prev_max = bounding_vectors_from_bones(self.bone_bound_vecs, self.action_abs_pose_matrices[action][init_frame])
+                frames, bone_abs_pose_matrices = self.action_abs_pose_matrices[action]
+                frames_min, frames_max = bounding_vectors_from_bones(self.bone_bound_vecs, bone_abs_pose_matrices)
 
                 if self.bl_op.use_only_max_bounds:
-                    if not frame_list:
-                        continue
-
-                    for frame in frame_list[1:]:
-                        bnds_min, bnds_max = bounding_vectors_from_bones(self.bone_bound_vecs, self.action_abs_pose_matrices[action][frame])
-
-                        for ii in range(3):
-                            prev_min[ii] = min(prev_min[ii], bnds_min[ii])
-
-                        for ii in range(3):
-                            prev_max[ii] = max(prev_max[ii], bnds_max[ii])
-
-                    bnds_data[0].append(init_frame)
-                    bnds_data[1].append(to_m3_bnds((prev_min, prev_max)))
-
+                    bnds_data[0].append(frames[0])
+                    bnds_data[1].append(to_m3_bnds((mathutils.Vector(frames_min.min(axis=0)), mathutils.Vector(frames_max.max(axis=0)))))
                 else:
-                    bnds_data[0].append(init_frame)
-                    bnds_data[1].append(to_m3_bnds((prev_min, prev_max)))
-
-                    for frame in frame_list[0::3]:
-                        bnds_min, bnds_max = bounding_vectors_from_bones(self.bone_bound_vecs, self.action_abs_pose_matrices[action][frame])
-                        if (prev_min - bnds_min).length >= 0.03 or (prev_max - bnds_max).length >= 0.03:
-                            bnds_data[0].append(frame)
-                            bnds_data[1].append(to_m3_bnds((bnds_min, bnds_max)))
-                            prev_min, prev_max = bnds_min, bnds_max
-
-            section_pos = self.m3.index(self.stc_to_name_section[stc_list[-1]])  # initially position behind name
+                    # keys are placed where interpolating between the kept keys would stray from the bounds of any frame
+                    frames_bounds = np.concatenate((frames_min, frames_max), axis=1)
+                    kept = reduce_anim_keys(np.array(frames), frames_bounds, np.empty(0), 0.03, np_lerp, bounds_errors)
+                    for frame_index in kept.tolist():
+                        bnds_data[0].append(frames[frame_index])
+                        bnds_data[1].append(to_m3_bnds((mathutils.Vector(frames_min[frame_index]), mathutils.Vector(frames_max[frame_index]))))
 
             for stc in stc_list:
 
@@ -1316,13 +1448,13 @@ class Exporter():
                     evnt_name_sections.append(evnt_name_section)
                     evnt.matrix = to_m3_matrix(mathutils.Matrix(((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1))))
 
-                ids_section = self.m3.section_for_reference(stc, 'anim_ids', pos=section_pos)
+                # anim id and ref sections are placed before the name section, and data sections after it
+                stc_name_section = self.stc_to_name_section[stc]
+                ids_section = self.m3.section_for_reference(stc, 'anim_ids', pos=None)
                 ids_sections.append(ids_section)
-                section_pos += 1
                 stc_ids_section[stc] = ids_section
-                refs_section = self.m3.section_for_reference(stc, 'anim_refs', pos=section_pos)
-                section_pos += 1
-                section_pos += 1  # hop over sts name section
+                refs_section = self.m3.section_for_reference(stc, 'anim_refs', pos=None)
+                self.m3.place_before(stc_name_section, ids_section, refs_section)
 
                 anim_fend = float('-inf')
 
@@ -1344,8 +1476,8 @@ class Exporter():
                     action_data = self.action_to_anim_data[action][section_data_name]
                     attr_name = section_data_name.lower()
 
-                    data_section = self.m3.section_for_reference(stc, attr_name, pos=section_pos)
-                    section_pos += 1
+                    data_section = self.m3.section_for_reference(stc, attr_name, pos=None)
+                    self.m3.place_after(stc_name_section, data_section)
 
                     for ii, id_num in enumerate(action_data):
                         data_head = data_section.content_add()
@@ -1355,30 +1487,26 @@ class Exporter():
 
                         data_head.fend = to_m3_ms(anim_fend)
 
-                        frames_section = self.m3.section_for_reference(data_head, 'frames', pos=section_pos)
+                        frames_section = self.m3.section_for_reference(data_head, 'frames', pos=None)
                         frames_section.content_add(*(to_m3_ms(frame) for frame in action_data[id_num][0]))
-                        section_pos += 1
 
-                        values_section = self.m3.section_for_reference(data_head, 'keys', pos=section_pos, version=evnt_version if section_data_name == 'SDEV' else 0)
+                        values_section = self.m3.section_for_reference(data_head, 'keys', pos=None, version=evnt_version if section_data_name == 'SDEV' else 0)
                         values_section.content_add(*action_data[id_num][1])
-                        section_pos += 1
+                        self.m3.place_after(stc_name_section, frames_section, values_section)
 
                         if section_data_name == 'SDEV':
                             data_head.flags = 1
+                            self.m3.place_after(stc_name_section, *evnt_name_sections)
 
-                            for evnt_name_section in evnt_name_sections:
-                                self.m3.insert(section_pos, evnt_name_section)
-                                section_pos += 1
-
-        section_pos = self.m3.index(self.stg_last_indice_section) + 1
-        sts_section = self.m3.section_for_reference(model, 'sts', pos=section_pos)
-        section_pos += 1
+        sts_section = self.m3.section_for_reference(model, 'sts', pos=None)
+        sts_ids_sections = []
         for action, stc_list in self.action_to_stc.items():
             for stc in stc_list:
                 sts = sts_section.content_add()
-                sts_ids_section = self.m3.section_for_reference(sts, 'anim_ids', pos=section_pos)
+                sts_ids_section = self.m3.section_for_reference(sts, 'anim_ids', pos=None)
                 sts_ids_section.content = stc_ids_section[stc].content
-                section_pos += 1
+                sts_ids_sections.append(sts_ids_section)
+        self.m3.place_after(self.stg_last_indice_section, sts_section, *sts_ids_sections)
 
     def create_bones(self, model, bones, sequences):
         if not bones:
@@ -1456,6 +1584,11 @@ class Exporter():
         if not (self.bl_op.output_anims or self.is_m3a):
             return
 
+        scene_bones = bones
+        if self.bl_op.sample_fcurves:
+            scene_evaluated_bones = self.get_scene_evaluated_bones(bones)
+            scene_bones = [pb for pb in bones if pb in scene_evaluated_bones]
+
         for anim_group in sequences:
             for anim in anim_group.animations:
                 if anim.action is None or anim.action in calc_actions:
@@ -1466,117 +1599,93 @@ class Exporter():
                 # maximum optimization would keep calls to ob_anim_data_set and frame_set to an absolute minimum
                 ob_anim_data_set(self.scene, self.ob, anim.action)
 
-                # jog animation frame so that complicated pose calculations are completed before proceeding
-                # TODO make an export option to step through a given number of previous frames to allow completion of timed calculations (ie wigglebone)
-                self.scene.frame_set(0)
-
                 frames_range = range(self.action_frame_range[anim.action][0], self.action_frame_range[anim.action][1] + 1)
                 frames = list(frames_range)
+                anim_frames = np.array(frames)
+                action_fcurves = self.action_fcurves[anim.action]
 
                 bone_to_pose_matrices = {bone: [] for bone in bones}
-                frame_to_bone_abs_pose_matrix = {frame: {} for frame in frames}
-                self.action_abs_pose_matrices[anim.action] = frame_to_bone_abs_pose_matrix
 
-                seq = list(range(4))
+                # sampled bones are read before the scene is evaluated, while their unanimated properties hold default values
+                for pb in bones:
+                    if pb not in scene_bones:
+                        bone_to_pose_matrices[pb] = sample_pose_bone_basis_matrices(action_fcurves, pb, frames)
 
-                for frame in frames:
+                # jog animation frame so that complicated pose calculations are completed before proceeding
+                # TODO make an export option to step through a given number of previous frames to allow completion of timed calculations (ie wigglebone)
+                if scene_bones:
+                    self.scene.frame_set(0)
+
+                for frame in (frames if scene_bones else []):
                     self.scene.frame_set(frame)
 
-                    for pb in bones:
-                        pose_matrix = self.ob.convert_space(pose_bone=pb, matrix=pb.matrix, from_space='POSE', to_space='LOCAL')
-                        for ii in seq:  # fixes edge case where numbers ~ -0 should be interpreted as 0
-                            for jj in seq:
-                                if abs(pose_matrix[ii][jj]) < 0.00001:
-                                    pose_matrix[ii][jj] = 0
-                        bone_to_pose_matrices[pb].append(pose_matrix)
+                    for pb in scene_bones:
+                        bone_to_pose_matrices[pb].append(self.ob.convert_space(pose_bone=pb, matrix=pb.matrix, from_space='POSE', to_space='LOCAL'))
 
-                bone_m3_pose_matrices = {bone: [] for bone in bones}
+                bone_m3_pose_matrices = {}
 
                 for pose_bone in bones:
                     data_bone = self.ob.data.bones.get(pose_bone.name)
                     m3_bone = bone_to_m3_bone[pose_bone]
                     left_correction_matrix, right_correction_matrix = self.bone_to_correction_matrices[pose_bone]
 
-                    anim_locs = []
-                    anim_rots = []
-                    anim_scls = []
-
-                    loc_fcurves = [anim.action.fcurves.find(pose_bone.path_from_id('location'), index=ii) for ii in range(3)]
-                    loc_keyframes = []
-                    for ii, fcurve in enumerate(loc_fcurves):
-                        if fcurve:
-                            fcurve.keyframe_points.foreach_get('co', coords := [0] * (len(fcurve.keyframe_points) * 2))
-                            loc_keyframes.extend(coords[0::1])
-                    loc_keyframes = set(loc_keyframes)
-
-                    rot_fcurves = [anim.action.fcurves.find(pose_bone.path_from_id('rotation_quaternion'), index=ii) for ii in range(4)]
-                    rot_keyframes = []
-                    for ii, fcurve in enumerate(rot_fcurves):
-                        if fcurve:
-                            fcurve.keyframe_points.foreach_get('co', coords := [0] * (len(fcurve.keyframe_points) * 2))
-                            rot_keyframes.extend(coords[0::1])
-                    rot_keyframes = set(rot_keyframes)
-
-                    scl_fcurves = [anim.action.fcurves.find(pose_bone.path_from_id('scale'), index=ii) for ii in range(3)]
-                    scl_keyframes = []
-                    for ii, fcurve in enumerate(scl_fcurves):
-                        if fcurve:
-                            fcurve.keyframe_points.foreach_get('co', coords := [0] * (len(fcurve.keyframe_points) * 2))
-                            scl_keyframes.extend(coords[0::1])
-                    scl_keyframes = set(scl_keyframes)
-
-                    frame_start = self.action_frame_range[anim.action][0]
-
-                    for pose_matrix in bone_to_pose_matrices[pose_bone]:
-                        m3_pose_matrix = left_correction_matrix @ pose_matrix @ right_correction_matrix
-                        # storing these and operating on them later if boundings are needed
-                        bone_m3_pose_matrices[pose_bone].append(m3_pose_matrix)
-                        m3_pose = m3_pose_matrix.decompose()
-                        anim_locs.append(m3_pose[0])
-                        anim_rots.append(m3_pose[1])
-                        anim_scls.append(m3_pose[2])
-
-                    if vec_list_contains_not_only(anim_locs, m3_bone_defaults[m3_bone][0]):
-                        keys, values = simplify_anim_data_with_interp(frames, loc_keyframes, anim_locs, vec_interp, vec_equal)
-                        self.action_to_anim_data[anim.action]['SD3V'][m3_bone.location.header.id] = (keys, [to_m3_vec3(val) for val in values])
+                    # keyframes set by the user are kept through key reduction
+                    loc_keyframes = fcurves_keyframe_frames(action_fcurves.get((pose_bone.path_from_id('location'), ii)) for ii in range(3))
+                    rot_keyframes = fcurves_keyframe_frames(action_fcurves.get((pose_bone.path_from_id('rotation_quaternion'), ii)) for ii in range(4))
+                    scl_keyframes = fcurves_keyframe_frames(action_fcurves.get((pose_bone.path_from_id('scale'), ii)) for ii in range(3))
+
+                    # the pose matrices of all frames are corrected and decomposed at once
+                    pose_matrices = np.array(bone_to_pose_matrices[pose_bone], dtype=np.float64).reshape(-1, 4, 4)
+                    pose_matrices[np.abs(pose_matrices) < 0.00001] = 0  # fixes edge case where numbers ~ -0 should be interpreted as 0
+                    m3_pose_matrices = np.array(left_correction_matrix) @ pose_matrices @ np.array(right_correction_matrix)
+                    # storing these and operating on them later if boundings are needed
+                    bone_m3_pose_matrices[pose_bone] = m3_pose_matrices
+                    anim_locs, anim_rots, anim_scls = np_decompose_matrices(m3_pose_matrices)
+                    default_loc, default_rot, default_scl = (np.array(val)[None] for val in m3_bone_defaults[m3_bone])
+
+                    if (np_vec_errors(anim_locs, default_loc) >= self.bl_op.anim_error_location).any():
+                        kept = reduce_anim_keys(anim_frames, anim_locs, loc_keyframes, self.bl_op.anim_error_location, np_lerp, np_vec_errors)
+                        self.action_to_anim_data[anim.action]['SD3V'][m3_bone.location.header.id] = (anim_frames[kept].tolist(), [to_m3_vec3(val) for val in anim_locs[kept].tolist()])
                         self.action_to_sdmb_user[anim.action] = not anim.concurrent
                         m3_bone.bit_set('flags', 'animated', True)
 
-                    if quat_list_contains_not_only(anim_rots, m3_bone_defaults[m3_bone][1]):
-                        quats_compatibility(anim_rots)
-                        keys, values = simplify_anim_data_with_interp(frames, rot_keyframes, anim_rots, quat_interp, quat_equal)
-                        self.action_to_anim_data[anim.action]['SD4Q'][m3_bone.rotation.header.id] = (keys, [to_m3_quat(val) for val in values])
+                    if (np_quat_errors(anim_rots, default_rot) >= self.bl_op.anim_error_rotation).any():
+                        anim_rots = np_quats_compatibility(anim_rots)
+                        kept = reduce_anim_keys(anim_frames, anim_rots, rot_keyframes, self.bl_op.anim_error_rotation, np_slerp, np_quat_errors)
+                        self.action_to_anim_data[anim.action]['SD4Q'][m3_bone.rotation.header.id] = (anim_frames[kept].tolist(), [to_m3_quat(val) for val in anim_rots[kept].tolist()])
                         self.action_to_sdmb_user[anim.action] = not anim.concurrent
                         m3_bone.bit_set('flags', 'animated', True)
 
-                    if vec_list_contains_not_only(anim_scls, m3_bone_defaults[m3_bone][2]):
-                        keys, values = simplify_anim_data_with_interp(frames, scl_keyframes, anim_scls, vec_interp, vec_equal)
-                        self.action_to_anim_data[anim.action]['SD3V'][m3_bone.scale.header.id] = (keys, [to_m3_vec3(val) for val in values])
+                    if (np_vec_errors(anim_scls, default_scl) >= self.bl_op.anim_error_scale).any():
+                        kept = reduce_anim_keys(anim_frames, anim_scls, scl_keyframes, self.bl_op.anim_error_scale, np_lerp, np_vec_errors)
+                        self.action_to_anim_data[anim.action]['SD3V'][m3_bone.scale.header.id] = (anim_frames[kept].tolist(), [to_m3_vec3(val) for val in anim_scls[kept].tolist()])
                         self.action_to_sdmb_user[anim.action] = not anim.concurrent
                         m3_bone.bit_set('flags', 'animated', True)
 
                     # export animated batching property
-                    m3_batching_fcurve = anim.action.fcurves.find(pose_bone.path_from_id('m3_batching'))
+                    m3_batching_fcurve = action_fcurves.get((pose_bone.path_from_id('m3_batching'), 0))
                     m3_batching_frames = get_fcurve_anim_frames(m3_batching_fcurve)
 
                     if m3_batching_frames:
                         m3_bone.bit_set('flags', 'batch1', True)
                         m3_bone.bit_set('flags', 'batch2', True)
-                        m3_batching_values = [int(m3_batching_fcurve.evaluate(frame)) for frame in m3_batching_frames]
+                        m3_batching_values = [int(val) for val in sample_fcurve(m3_batching_fcurve, m3_batching_frames).tolist()]
                         self.action_to_anim_data[anim.action]['SDFG'][m3_bone.batching.header.id] = (m3_batching_frames, m3_batching_values)
 
                 # calculate absolute pose matrices only if needed for boundings
+                # bones are ordered after their parents, so the matrices of all frames are accumulated down the hierarchy
+                bone_abs_pose_matrices = {}
                 if self.action_to_sdmb_user[anim.action]:
                     for bone in bones:
-                        for jj, m3_pose_matrix in enumerate(bone_m3_pose_matrices[bone]):
+                        if bone.parent is not None:
+                            parent_abs_pose_matrices = bone_abs_pose_matrices[bone.parent]
+                            abs_bone_matrices = parent_abs_pose_matrices @ np.array(self.bone_to_iref[bone.parent].inverted()) @ bone_m3_pose_matrices[bone]
+                        else:
+                            abs_bone_matrices = bone_m3_pose_matrices[bone]
 
-                            if bone.parent is not None:
-                                parent_abs_pose_matrix = frame_to_bone_abs_pose_matrix[jj + frame_start][bone.parent]
-                                abs_bone_matrix = parent_abs_pose_matrix @ self.bone_to_iref[bone.parent].inverted() @ m3_pose_matrix
-                            else:
-                                abs_bone_matrix = m3_pose_matrix
+                        bone_abs_pose_matrices[bone] = abs_bone_matrices @ np.array(self.bone_to_iref[bone])
 
-                            frame_to_bone_abs_pose_matrix[jj + frame_start][bone] = abs_bone_matrix @ self.bone_to_iref[bone]
+                self.action_abs_pose_matrices[anim.action] = (frames, bone_abs_pose_matrices)
 
         # place armature in the default pose again so that default values of m3 properties are accessed properly
         ob_anim_data_set(self.scene, self.ob, None)
@@ -1657,11 +1766,14 @@ class Exporter():
         region_section = self.m3.section_for_reference(div, 'regions', version=regn_version, pos=None if self.is_m3a else -1)
         batch_section = self.m3.section_for_reference(div, 'batches', version=1, pos=None if self.is_m3a else -1)
 
+        m3_vertex_dtype = np_dtype_from_desc(m3_vertex_desc)
         m3_vertices = []
+        m3_vertex_count = 0
         m3_faces = []
         m3_lookup = []
 
-        bone_bounding_points = {bone: [] for bone in bones}
+        bone_bounds_min = np.full((len(bones), 3), np.inf)
+        bone_bounds_max = np.full((len(bones), 3), -np.inf)
 
         ob_to_regions = {}
         region_to_batch_bone = {}
@@ -1673,32 +1785,14 @@ class Exporter():
         if export_skin1:
             deformations_count += 2
 
-        m3_vert_id_eval = 'lambda m3v: (m3v.pos.x, m3v.pos.y, m3v.pos.z'
-        if export_normal:
-            m3_vert_id_eval += ', m3v.normal.x, m3v.normal.y, m3v.normal.z'
-        if deformations_count > 0:
-            m3_vert_id_eval += ', m3v.lookup0, m3v.lookup1, m3v.weight0, m3v.weight1'
-        if deformations_count > 2:
-            m3_vert_id_eval += ', m3v.lookup2, m3v.lookup3, m3v.weight2, m3v.weight3'
-        if export_col:
-            m3_vert_id_eval += ', m3v.col.r, m3v.col.g, m3v.col.b, m3v.col.a'
-        for ii in range(self.uv_count):
-            m3_vert_id_eval += f', m3v.uv{ii}.x, m3v.uv{ii}.y'
-        m3_vert_id_eval += ')'
-
-        # generating this lambda function to keep the conditional logic
-        # of which vert properties to get outside of the vert loop
-        m3_vert_id_get = eval(m3_vert_id_eval)
-
         for ob_index, ob in enumerate(mesh_objects):
             bm = bmesh.new(use_operators=True)
             bm.from_object(ob, self.depsgraph)
             bmesh.ops.transform(bm, matrix=ob.matrix_local, verts=bm.verts, use_shapekey=False)
             bmesh.ops.triangulate(bm, faces=bm.faces)
+            bm.normal_update()
 
             layer_deform = bm.verts.layers.deform.verify()
-            layer_color = bm.loops.layers.color.get('m3color')
-            layer_alpha = bm.loops.layers.color.get('m3alpha')
 
             layers_uv = bm.loops.layers.uv.values()
 
@@ -1710,12 +1804,8 @@ class Exporter():
                             layers_uv[ii] = uv_layer
                             break
 
-            layers_uv = layers_uv[0:self.uv_count]
-            layer_tan = layers_uv[0]
-            vertex_lookups_used = 0
+            uv_layer_names = [uv_layer.name for uv_layer in layers_uv[0:self.uv_count]]
 
-            region_vertices = []
-            region_faces = []
             region_lookup = []
             group_to_lookup_ii = {}
             for ii, group in enumerate(ob.vertex_groups):
@@ -1726,103 +1816,168 @@ class Exporter():
                     if not deformations_count:
                         break
 
-            region_vert_id_to_vert = {}
-            region_vert_count = 0
-
-            no_deform_verts = 0
-
-            for face in bm.faces:
-                loops = face.loops
-
-                c1, c2, c3 = (L.vert.co for L in loops)
-                u1, u2, u3 = (L[layer_tan].uv[0] for L in loops)
-                v1, v2, v3 = (L[layer_tan].uv[1] for L in loops)
-
-                d = (v2 - v1) * (u3 - u1) - (u2 - u1) * (v3 - v1)
-                try:
-                    tan = (((v3 - v1) * (c2 - c1) - (v2 - v1) * (c3 - c1)) / -d).normalized()
-                except ZeroDivisionError:
-                    tan = mathutils.Vector((0, 0, 0))
-
-                for loop in loops:
-                    co = loop.vert.co
-                    m3_vert = m3_vertex_desc.instance()
-                    m3_vert.pos = to_m3_vec3(co)
-
-                    # only count groups which have a lookup match, sort by weight and then limit to a length of 4
-                    deformations = []
-                    for deformation in loop.vert[layer_deform].items():
-                        lookup_ii = group_to_lookup_ii.get(deformation[0])
-                        if lookup_ii is not None and deformation[1]:
-                            deformations.append([lookup_ii, deformation[1]])
-                            bone_bounding_points[bones[region_lookup[lookup_ii]]].append(co.copy())
-
-                    if deformations_count:
-
-                        deformations.sort(key=lambda x: x[1])
-                        deformations = deformations[0:min(deformations_count, len(deformations))]
-
-                        if not len(deformations):
-                            no_deform_verts += 1
-
-                        # normalize the weights
-                        sum_weight = 0
-                        for index, weight in deformations:
-                            sum_weight += weight
-
-                        remaining_weight = 255
-                        for ii in range(len(deformations)):
-                            lookup = deformations[ii][0]
-                            weight = min(remaining_weight, round(deformations[ii][1] / sum_weight * 255))
-                            remaining_weight = max(0, remaining_weight - weight)
-                            if weight > 0:
-                                setattr(m3_vert, 'lookup' + str(ii), lookup)
-                                setattr(m3_vert, 'weight' + str(ii), weight)
-
-                        # sometimes there is 1 remaining weight left due to rounding errors
-                        # so we just add it onto the first lookup to prevent model glitches
-                        setattr(m3_vert, 'weight0', m3_vert.weight0 + remaining_weight)
-
-                    for ii in range(self.uv_count):
-                        uv_layer = layers_uv[ii] if ii < len(layers_uv) else None
-                        if uv_layer:
-                            uv = loop[uv_layer].uv
-                            setattr(m3_vert, 'uv' + str(ii), to_m3_uv(uv))
-                            # setattr(m3_vert, 'fuv' + str(ii), to_m3_vec2((uv[0] / 16, 1 - uv[1] / 16)))
-                        else:
-                            setattr(m3_vert, 'uv' + str(ii), to_m3_uv((0, 0)))
-                            # setattr(m3_vert, 'fuv' + str(ii), to_m3_vec2((0.0, 0.0)))
-
-                    if export_col:
-                        try:
-                            m3_vert.col = to_m3_color((*loop[layer_color][0:3], sum(loop[layer_alpha][0:3]) / 3))
-                        except AttributeError:
-                            m3_vert.col = to_m3_color((1, 1, 1, 1))
-
-                    m3_vert.normal = to_m3_vec3_uint8(loop.vert.normal)
-                    m3_vert.tan = to_m3_vec3_uint8(tan)
-                    m3_vert.sign = 0 if d < 0 else 255
-
-                    id_tuple = m3_vert_id_get(m3_vert)
-                    id_index = region_vert_id_to_vert.get(id_tuple)
-                    if id_index is None:
-                        id_index = region_vert_count
-                        region_vert_id_to_vert[id_tuple] = id_index
-
-                        vertex_lookups_used = max(vertex_lookups_used, len(deformations))
-
-                        m3_vertex_desc.instance_validate(m3_vert, 'vertex')
-                        region_vertices.append(m3_vert)
-                        region_vert_count += 1
-
-                    region_faces.append(id_index)
+            # weights are gathered as sparse (vertex, lookup, weight) entries, only counting groups which have a lookup match
+            # bmesh gives no bulk access to deform weights, so they are still read from each vertex
+            deform_items = [(vert_index, group, weight) for vert_index, vert in enumerate(bm.verts) for group, weight in vert[layer_deform].items()]
+            deform_verts, deform_groups, deform_weights = np.array(deform_items, dtype=np.float64).reshape(-1, 3).T
+            group_lookups = np.full(len(ob.vertex_groups), -1, dtype=np.int64)
+            group_lookups[list(group_to_lookup_ii.keys())] = list(group_to_lookup_ii.values())
+            # weights may remain for vertex groups which no longer exist, these are ignored
+            deform_groups = deform_groups.astype(np.int64)
+            deform_lookups = np.full(len(deform_groups), -1, dtype=np.int64)
+            deform_in_range = deform_groups < len(group_lookups)
+            deform_lookups[deform_in_range] = group_lookups[deform_groups[deform_in_range]]
+            deform_valid = (deform_lookups >= 0) & (deform_weights > 0)
+            deform_verts = deform_verts[deform_valid].astype(np.int64)
+            deform_lookups = deform_lookups[deform_valid]
+            deform_weights = deform_weights[deform_valid].astype(np.float32)
+
+            # the triangulated mesh is written to a temporary mesh so that its data can be read in bulk
+            me = bpy.data.meshes.new('M3 Export')
+            bm.to_mesh(me)
+            bm.free()
+
+            vert_cos = np.empty(len(me.vertices) * 3, dtype=np.float32)
+            me.vertices.foreach_get('co', vert_cos)
+            vert_cos = vert_cos.reshape(-1, 3)
+            vert_normals = np.empty(len(me.vertices) * 3, dtype=np.float32)
+            me.vertices.foreach_get('normal', vert_normals)
+            vert_normals = vert_normals.reshape(-1, 3)
+            loop_verts = np.empty(len(me.loops), dtype=np.int32)
+            me.loops.foreach_get('vertex_index', loop_verts)
+
+            loop_uvs = []
+            for uv_layer_name in uv_layer_names:
+                uvs = np.empty(len(me.loops) * 2, dtype=np.float32)
+                me.uv_layers[uv_layer_name].data.foreach_get('uv', uvs)
+                loop_uvs.append(uvs.reshape(-1, 2))
+
+            loop_colors = None
+            if export_col:
+                loop_colors = np.ones((len(me.loops), 4), dtype=np.float32)
+                vertex_col = me.vertex_colors.get('m3color')
+                vertex_alpha = me.vertex_colors.get('m3alpha')
+                if vertex_col:
+                    cols = np.empty(len(me.loops) * 4, dtype=np.float32)
+                    vertex_col.data.foreach_get(VERTEX_COLOR_PROP, cols)
+                    loop_colors[:, 0:3] = cols.reshape(-1, 4)[:, 0:3]
+                if vertex_alpha:
+                    cols = np.empty(len(me.loops) * 4, dtype=np.float32)
+                    vertex_alpha.data.foreach_get(VERTEX_COLOR_PROP, cols)
+                    loop_colors[:, 3] = cols.reshape(-1, 4)[:, 0:3].mean(axis=1)
+
+            bpy.data.meshes.remove(me)
+
+            vert_lookups = np.zeros((len(vert_cos), max(deformations_count, 1)), dtype=np.uint8)
+            vert_weights = np.zeros((len(vert_cos), max(deformations_count, 1)), dtype=np.uint8)
+            vert_deformations_len = np.zeros(len(vert_cos), dtype=np.int64)
+
+            vert_used = np.zeros(len(vert_cos), dtype=bool)
+            vert_used[loop_verts] = True
+
+            # bone bounds enclose every used vertex which has any weight to the bone
+            bound_entries = vert_used[deform_verts]
+            bound_verts = deform_verts[bound_entries]
+            bound_bones = np.array(region_lookup, dtype=np.int64)[deform_lookups[bound_entries]]
+            np.minimum.at(bone_bounds_min, bound_bones, vert_cos[bound_verts])
+            np.maximum.at(bone_bounds_max, bound_bones, vert_cos[bound_verts])
+
+            if deformations_count:
+                # the largest weights are kept up to a length of 4, then ordered by ascending weight with empty slots last
+                # entries are sorted by vertex and descending weight, so that those of each vertex are ranked by their position
+                top_count = min(deformations_count, len(region_lookup))
+                entry_order = np.lexsort((deform_lookups, -deform_weights, deform_verts))
+                entry_verts = deform_verts[entry_order]
+                entry_ranks = np.arange(len(entry_verts)) - np.searchsorted(entry_verts, entry_verts)
+                entry_kept = entry_ranks < top_count
+                entry_top = entry_order[entry_kept]
+                top_lookups = np.zeros((len(vert_cos), top_count), dtype=np.int64)
+                top_weights = np.zeros((len(vert_cos), top_count), dtype=np.float64)
+                top_lookups[deform_verts[entry_top], entry_ranks[entry_kept]] = deform_lookups[entry_top]
+                top_weights[deform_verts[entry_top], entry_ranks[entry_kept]] = deform_weights[entry_top]
+                top_order = np.argsort(np.where(top_weights > 0, top_weights, np.inf), axis=1, kind='stable')
+                top_lookups = np.take_along_axis(top_lookups, top_order, axis=1)
+                top_weights = np.take_along_axis(top_weights, top_order, axis=1)
+                vert_deformations_len[:] = (top_weights > 0).sum(axis=1)
+
+                # normalize the weights, where each weight is limited to what remains of 255 after the weights before it
+                sum_weights = top_weights.sum(axis=1, keepdims=True)
+                byte_weights = np.round(np.divide(top_weights, sum_weights, out=np.zeros_like(top_weights), where=sum_weights > 0) * 255)
+                byte_weights_total = np.minimum(255, np.cumsum(byte_weights, axis=1))
+                byte_weights = np.diff(byte_weights_total, axis=1, prepend=0).astype(np.uint8)
+                vert_lookups[:, 0:top_count] = np.where(byte_weights > 0, top_lookups, 0)
+                vert_weights[:, 0:top_count] = byte_weights
+
+                # sometimes there is 1 remaining weight left due to rounding errors
+                # so we just add it onto the first lookup to prevent model glitches
+                if top_count:
+                    vert_weights[:, 0] += (255 - byte_weights_total[:, -1]).astype(np.uint8)
+                else:
+                    vert_weights[:, 0] = 255
 
-            if no_deform_verts:
+            if deformations_count and not vert_deformations_len[loop_verts].all():
                 self.warn_strings.append(f'{str(ob)} has at least one vertex with no weight given to a valid bone and will not be exported')
                 continue
 
-            first_vertex_index = len(m3_vertices)
-            m3_vertices.extend(region_vertices)
+            # tangents are calculated per triangle, from the positions and first uv layer of its loops
+            tri_cos = vert_cos[loop_verts].astype(np.float64).reshape(-1, 3, 3)
+            tri_uvs = loop_uvs[0].astype(np.float64).reshape(-1, 3, 2) if loop_uvs else np.zeros((len(tri_cos), 3, 2))
+            tri_tans, tri_signs = np_tri_tangents(tri_cos, tri_uvs)
+
+            # vertex data is assembled for every loop, then deduplicated
+            region_loop_vertices = np.zeros(len(loop_verts), dtype=m3_vertex_dtype)
+            region_loop_vertices['pos']['x'], region_loop_vertices['pos']['y'], region_loop_vertices['pos']['z'] = vert_cos[loop_verts].T
+
+            for ii in range(deformations_count):
+                region_loop_vertices['lookup' + str(ii)] = vert_lookups[loop_verts, ii]
+                region_loop_vertices['weight' + str(ii)] = vert_weights[loop_verts, ii]
+
+            for ii in range(self.uv_count):
+                uvs = to_np_uv(loop_uvs[ii] if ii < len(loop_uvs) else np.zeros((len(loop_verts), 2)))
+                region_loop_vertices['uv' + str(ii)]['x'], region_loop_vertices['uv' + str(ii)]['y'] = uvs.T
+
+            if export_col:
+                cols = np.clip(np.round(loop_colors.astype(np.float64) * 255), 0, 255).astype(np.uint8)
+                for ii, channel in enumerate('rgba'):
+                    region_loop_vertices['col'][channel] = cols[:, ii]
+
+            if export_normal:
+                normals = to_np_vec3_uint8(vert_normals[loop_verts])
+                region_loop_vertices['normal']['x'], region_loop_vertices['normal']['y'], region_loop_vertices['normal']['z'] = normals.T
+                tans = np.repeat(to_np_vec3_uint8(tri_tans), 3, axis=0)
+                region_loop_vertices['tan']['x'], region_loop_vertices['tan']['y'], region_loop_vertices['tan']['z'] = tans.T
+                region_loop_vertices['sign'] = np.repeat(tri_signs, 3)
+
+            # vertices are identified by all of their data except for tangents, in the order of their first loop
+            # smoothed tangents are not shared between loops of opposite handedness, so the sign is kept in that case
+            loop_vertex_ids = region_loop_vertices.copy()
+            if export_normal:
+                loop_vertex_ids['tan'] = 0
+                if not self.bl_op.smooth_tangents:
+                    loop_vertex_ids['sign'] = 0
+            loop_vertex_ids = loop_vertex_ids.view(np.dtype((np.void, m3_vertex_dtype.itemsize)))
+            unique_first_loops, unique_inverse = np.unique(loop_vertex_ids, return_index=True, return_inverse=True)[1:]
+            unique_order = np.argsort(unique_first_loops, kind='stable')
+            unique_ranks = np.empty_like(unique_order)
+            unique_ranks[unique_order] = np.arange(len(unique_order))
+
+            region_vertices = region_loop_vertices[unique_first_loops[unique_order]]
+            region_faces = unique_ranks[unique_inverse.ravel()].tolist()
+
+            if export_normal and self.bl_op.smooth_tangents:
+                # triangle tangents are summed per vertex weighted by corner angle, then made orthogonal to the vertex normal
+                loop_tans = np.repeat(tri_tans, 3, axis=0) * np_tri_corner_angles(tri_cos).reshape(-1, 1)
+                vertex_tans = np.zeros((len(unique_first_loops), 3))
+                np.add.at(vertex_tans, unique_inverse.ravel(), loop_tans)
+                vertex_normals = vert_normals[loop_verts[unique_first_loops]].astype(np.float64)
+                vertex_tans -= vertex_normals * (vertex_tans * vertex_normals).sum(axis=1, keepdims=True)
+                tans = to_np_vec3_uint8(np_normalized(vertex_tans)[unique_order])
+                region_vertices['tan']['x'], region_vertices['tan']['y'], region_vertices['tan']['z'] = tans.T
+            vertex_lookups_used = int(vert_deformations_len.max()) if len(vert_deformations_len) else 0
+
+            first_vertex_index = m3_vertex_count
+            m3_vertices.append(region_vertices)
+            m3_vertex_count += len(region_vertices)
 
             first_lookup_index = len(m3_lookup)
             m3_lookup.extend(region_lookup)
@@ -1907,21 +2062,19 @@ class Exporter():
 
         self.bone_bound_vecs = {}
 
-        for bone in bones:
-            if not bone_bounding_points[bone]:
-                continue
-            x_cos, y_cos, z_cos = zip(*bone_bounding_points[bone])
-            vec_min = mathutils.Vector((min(x_cos), min(y_cos), min(z_cos)))
-            vec_max = mathutils.Vector((max(x_cos), max(y_cos), max(z_cos)))
-            self.bone_bound_vecs[bone] = (vec_min, vec_max)
+        for bone_index in np.flatnonzero(np.isfinite(bone_bounds_min[:, 0])).tolist():
+            vec_min = mathutils.Vector(bone_bounds_min[bone_index].tolist())
+            vec_max = mathutils.Vector(bone_bounds_max[bone_index].tolist())
+            self.bone_bound_vecs[bones[bone_index]] = (vec_min, vec_max)
 
         self.region_section = region_section
 
         msec_section = self.m3.section_for_reference(div, 'msec', version=1)
         msec = msec_section.content_add()
-        msec.bounding = self.init_anim_ref_bnds(bounding_vectors_from_bones(self.bone_bound_vecs, self.bone_to_abs_pose_matrix))
+        bounds_min, bounds_max = bounding_vectors_from_bones(self.bone_bound_vecs, {bone: np.array(matrix) for bone, matrix in self.bone_to_abs_pose_matrix.items()})
+        msec.bounding = self.init_anim_ref_bnds((mathutils.Vector(bounds_min[0]), mathutils.Vector(bounds_max[0])))
 
-        vertex_section.content_add(*list(m3_vertex_desc.instances_to_bytearray(m3_vertices)))
+        vertex_section.content_add(*b''.join(region_vertices.tobytes() for region_vertices in m3_vertices))
         face_section.content_add(*m3_faces)
         bone_lookup_section = self.m3.section_for_reference(model, 'bone_lookup')
         bone_lookup_section.content_add(*m3_lookup)
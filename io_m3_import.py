@@ -16,29 +16,34 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
+import os
 import math
+import time
+import pickle
+import hashlib
+import runpy
 import traceback
+import tracemalloc
+import multiprocessing
+import concurrent.futures
+import numpy as np
 import bpy
 import bmesh
 import mathutils
 from . import io_m3
+from . import io_m3_batch
 from . import io_shared
 from . import shared
-from .m3_animations import set_default_value, ob_anim_data_set
+from .m3_animations import set_default_values, ob_anim_data_set
+from .io_m3_batch import FRAME_RATE, to_bl_frame, m3_key_collect_vec3, m3_key_collect_quat
 
 
-FRAME_RATE = 30
-
-
-def to_bl_frame(m3_ms):
-    return round(m3_ms / 1000 * FRAME_RATE)
-
-
-def to_bl_uv(m3_uv, uv_multiply, uv_offset):
-    return (
-        m3_uv.x * uv_multiply / 32768 + uv_offset,
-        -m3_uv.y * uv_multiply / 32768 - uv_offset + 1
-    )
+def to_np_uvs(m3_uvs, uv_multiply, uv_offset):
+    # (count, 2) array of the blender uv coordinates of a structured array of m3 uvs
+    return np.stack((
+        m3_uvs['x'].astype(np.float64) * uv_multiply / 32768 + uv_offset,
+        -m3_uvs['y'].astype(np.float64) * uv_multiply / 32768 - uv_offset + 1
+    ), axis=1)
 
 
 def to_bl_vec2(m3_vector):
@@ -70,6 +75,39 @@ def to_bl_matrix(m3_matrix):
     ))
 
 
+def to_np_matrices(m3_section, count):
+    # stacked (count, 4, 4) array of the Matrix44 instances of a section, laid out as in to_bl_matrix
+    if m3_section.raw_bytes is not None and len(m3_section.raw_bytes) >= count * 64:
+        matrices = np.frombuffer(m3_section.raw_bytes, dtype='<f4', count=count * 16).reshape(count, 4, 4)
+    else:
+        matrices = np.array([[
+            (m3_item.matrix.x.x, m3_item.matrix.x.y, m3_item.matrix.x.z, m3_item.matrix.x.w),
+            (m3_item.matrix.y.x, m3_item.matrix.y.y, m3_item.matrix.y.z, m3_item.matrix.y.w),
+            (m3_item.matrix.z.x, m3_item.matrix.z.y, m3_item.matrix.z.z, m3_item.matrix.z.w),
+            (m3_item.matrix.w.x, m3_item.matrix.w.y, m3_item.matrix.w.z, m3_item.matrix.w.w),
+        ] for m3_item in m3_section[:count]], dtype=np.float32).reshape(-1, 4, 4)
+    return matrices.transpose(0, 2, 1).astype(np.float64)
+
+
+def to_np_array(m3_section, dtype, fields=None):
+    # array of a section, with a column for each of the given fields of structure sections
+    width = len(fields) if fields else 1
+    if m3_section.raw_bytes is not None and len(m3_section.raw_bytes) >= len(m3_section) * m3_section.desc.size:
+        array = np.frombuffer(m3_section.raw_bytes, dtype=dtype, count=len(m3_section) * width)
+    elif fields:
+        array = np.array([[getattr(m3_item, field) for field in fields] for m3_item in m3_section], dtype=dtype)
+    else:
+        array = np.array(m3_section.content, dtype=dtype)
+    return array.reshape(-1, width) if fields else array
+
+
+def np_vector_angles(a, b):
+    # equivalent of mathutils.Vector.angle for each row pair, which is nan where either vector has no length
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos = np.einsum('ij,ij->i', a, b) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return np.arccos(np.clip(cos, -1, 1))
+
+
 class M3InputProcessor:
 
     def __init__(self, importer, bl, m3):
@@ -152,7 +190,7 @@ class M3InputProcessor:
     def anim_integer(self, field):
         anim_ref = getattr(self.m3, field)
         setattr(self.bl, field, anim_ref.default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, (anim_ref.default,))
+        key_fcurves(self.importer, self.bl, field, anim_ref.header, (anim_ref.default,))
 
     def anim_int16(self, field):
         self.anim_integer(field)
@@ -168,13 +206,13 @@ class M3InputProcessor:
             return
         anim_ref = getattr(self.m3, field)
         setattr(self.bl, field, anim_ref.default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, (anim_ref.default,))
+        key_fcurves(self.importer, self.bl, field, anim_ref.header, (anim_ref.default,))
 
     def anim_vec2(self, field):
         anim_ref = getattr(self.m3, field)
         default = to_bl_vec2(anim_ref.default)
         setattr(self.bl, field, default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, default)
+        key_fcurves(self.importer, self.bl, field, anim_ref.header, default)
 
     def anim_vec3(self, field, since_version=None):
         if (since_version is not None) and (self.version < since_version):
@@ -182,7 +220,7 @@ class M3InputProcessor:
         anim_ref = getattr(self.m3, field)
         default = to_bl_vec3(anim_ref.default)
         setattr(self.bl, field, default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, default)
+        key_fcurves(self.importer, self.bl, field, anim_ref.header, default)
 
     def anim_color(self, field, since_version=None):
         if (since_version is not None) and (self.version < since_version):
@@ -190,82 +228,86 @@ class M3InputProcessor:
         anim_ref = getattr(self.m3, field)
         default = to_bl_color(anim_ref.default)
         setattr(self.bl, field, default)
-        key_fcurves(self.importer.stc_id_data, self.bl, field, anim_ref.header, default)
-
-
-def m3_key_collect_evnt(key_frames, key_values):
-    pass  # handle these specially
-
-
-def m3_key_collect_real(key_frames, key_values):
-    ll = ([],)
-
-    for key_frame, key_value in zip(key_frames, key_values):
-        ll[0].extend((key_frame, key_value))
-
-    return ll
-
-
-def m3_key_collect_vec2(key_frames, key_values):
-    ll = ([], [])
-
-    for key_frame, key_value in zip(key_frames, key_values):
-        ll[0].extend((key_frame, key_value.x))
-        ll[1].extend((key_frame, key_value.y))
-
-    return ll
+        key_fcurves(self.importer, self.bl, field, anim_ref.header, default)
 
 
-def m3_key_collect_vec3(key_frames, key_values):
-    ll = ([], [], [])
+class M3InputPlanRecorder:
 
-    for key_frame, key_value in zip(key_frames, key_values):
-        ll[0].extend((key_frame, key_value.x))
-        ll[1].extend((key_frame, key_value.y))
-        ll[2].extend((key_frame, key_value.z))
+    def __init__(self):
+        self.calls = []
 
-    return ll
+    def __getattr__(self, method_name):
+        def record(*args, **kwargs):
+            self.calls.append((method_name, args, kwargs))
+        return record
 
 
-def m3_key_collect_quat(key_frames, key_values):
-    ll = ([], [], [], [])
+# simple properties without update callbacks or custom accessors can be written directly as id properties
+raw_prop_convert = {bpy.props.BoolProperty: int, bpy.props.IntProperty: int, bpy.props.FloatProperty: float}
 
-    for key_frame, key_value in zip(key_frames, key_values):
-        ll[0].extend((key_frame, key_value.w))
-        ll[1].extend((key_frame, key_value.x))
-        ll[2].extend((key_frame, key_value.y))
-        ll[3].extend((key_frame, key_value.z))
 
-    return ll
-
-
-def m3_key_collect_colo(key_frames, key_values):
-    ll = ([], [], [], [])
-
-    for key_frame, key_value in zip(key_frames, key_values):
-        ll[0].append(key_frame)
-        ll[0].append(key_value.r / 255)
-        ll[1].append(key_frame)
-        ll[1].append(key_value.g / 255)
-        ll[2].append(key_frame)
-        ll[2].append(key_value.b / 255)
-        ll[3].append(key_frame)
-        ll[3].append(key_value.a / 255)
-
-    return ll
+def bl_prop_raw_convert(bl_type, field):
+    for clss in bl_type.__mro__:
+        deferred = clss.__dict__.get('__annotations__', {}).get(field)
+        if deferred is not None:
+            break
+    else:
+        return None
+
+    keywords = getattr(deferred, 'keywords', None)
+    if keywords is None or {'get', 'set', 'update'}.intersection(keywords.keys()):
+        return None
+
+    convert = raw_prop_convert.get(getattr(deferred, 'function', None))
+    prop_min = keywords.get('min')
+    prop_max = keywords.get('max')
+
+    # id properties are not clamped to the property's bounds as rna assignment would be
+    if convert is not None and (prop_min is not None or prop_max is not None):
+        prop_min = -math.inf if prop_min is None else prop_min
+        prop_max = math.inf if prop_max is None else prop_max
+        return lambda val, convert=convert: convert(min(max(val, prop_min), prop_max))
+
+    return convert
+
+
+def m3_input_plan_compile(io_method, bl_type, desc):
+    recorder = M3InputPlanRecorder()
+    io_method(recorder)
+
+    raw_steps = []
+    steps = []
+    for method_name, args, kwargs in recorder.calls:
+        till_version = kwargs.get('till_version')
+        since_version = kwargs.get('since_version')
+        if (till_version is not None) and (desc.version > till_version):
+            continue
+        if (since_version is not None) and (desc.version < since_version):
+            continue
+
+        if method_name in ('boolean', 'integer', 'float', 'bit'):
+            field = args[0]
+            target = args[1] if method_name == 'bit' else field
+            convert = bl_prop_raw_convert(bl_type, target)
+            if convert is not None:
+                if method_name == 'bit':
+                    mask = desc.fields[field].bit_mask_map[target]
+                    convert = lambda val, mask=mask: int(val & mask != 0)
+                elif method_name == 'boolean':
+                    convert = lambda val: int(val != 0)
+                raw_steps.append((target, field, convert))
+                continue
 
+        steps.append((getattr(M3InputProcessor, method_name), args))
 
-def m3_key_collect_bnds(key_frames, key_values):
-    pass  # handle these specially
+    return raw_steps, steps
 
 
-m3_key_type_collection_method = [
-    m3_key_collect_evnt, m3_key_collect_vec2, m3_key_collect_vec3, m3_key_collect_quat, m3_key_collect_colo, m3_key_collect_real, m3_key_collect_real,
-    m3_key_collect_real, m3_key_collect_real, m3_key_collect_real, m3_key_collect_real, m3_key_collect_real, m3_key_collect_bnds,
-]
+# compiled per (io method, property group type, m3 structure description), shared between imports
+m3_input_plans = {}
 
 
-def key_fcurves(stc_dict, bl, field, header, default):
+def key_fcurves(importer, bl, field, header, default):
 
     if not hasattr(bl, field):
         return
@@ -273,12 +315,12 @@ def key_fcurves(stc_dict, bl, field, header, default):
     path = bl.path_from_id(field)
 
     for ii, val in enumerate(default):
-        set_default_value(bl.id_data.m3_animations_default, path, ii, val)
+        importer.default_values[(path, ii)] = val
 
     if type(header) == shared.M3AnimHeaderProp:
-        anim_id_data = stc_dict.get(int(header.hex_id, 16))
+        anim_id_data = importer.stc_id_data.get(int(header.hex_id, 16))
     else:
-        anim_id_data = stc_dict.get(header.id)
+        anim_id_data = importer.stc_id_data.get(header.id)
 
         bl_header = getattr(bl, field + '_header')
         bl_header.hex_id = hex(header.id)[2:]
@@ -294,30 +336,123 @@ def key_fcurves(stc_dict, bl, field, header, default):
     if not anim_id_data:
         return
 
-    for action_name in anim_id_data.keys():
-        anim_id_action_data = anim_id_data[action_name]
-        points_len = len(anim_id_action_data[0]) // 2
+    if type(header) == shared.M3AnimHeaderProp:
+        interpolation = 0 if header.interpolation == 'CONSTANT' else 1  # TODO calculate AUTO based on field name
+    else:
+        interpolation = header.interpolation
 
-        if type(header) == shared.M3AnimHeaderProp:
-            interp_seq = [0 if header.interpolation == 'CONSTANT' else 1] * points_len  # TODO calculate AUTO based on field name
-        else:
-            interp_seq = [header.interpolation] * points_len
-
-        key_sel_seq = [False] * points_len
-        for index, index_data in enumerate(anim_id_action_data):
-            fcurves = bpy.data.actions.get(action_name).fcurves
-            fcurve = fcurves.new(path, index=index)
-            fcurve.select = False
-            fcurve.keyframe_points.add(points_len)
-            fcurve.keyframe_points.foreach_set('co', index_data)
-            fcurve.keyframe_points.foreach_set('interpolation', interp_seq)
-            fcurve.keyframe_points.foreach_set('select_control_point', key_sel_seq)
-            fcurve.keyframe_points.foreach_set('select_left_handle', key_sel_seq)
-            fcurve.keyframe_points.foreach_set('select_right_handle', key_sel_seq)
-
-
-def armature_object_new():
-    scene = bpy.context.scene
+    for action_name, anim_id_action_data in anim_id_data.items():
+        importer.fcurves_key(action_name, path, anim_id_action_data, interpolation)
+
+
+# maps armature objects to [collections generation, collection lengths, {anim id: [rna paths]}], see anim_id_paths_get
+m3_anim_id_paths = {}
+
+
+def anim_id_paths_get(ob):
+    collections = [
+        ob.m3_cameras, ob.m3_forces, ob.m3_lights, ob.m3_materiallayers, ob.m3_materials_standard, ob.m3_materials_displacement,
+        ob.m3_materials_composite, ob.m3_materials_volume, ob.m3_materials_volumenoise, ob.m3_materials_reflection, ob.m3_materials_lensflare,
+        ob.m3_particlesystems, ob.m3_particlecopies, ob.m3_projections, ob.m3_ribbons, ob.m3_ribbonsplines, ob.m3_shadowboxes, ob.m3_warps,
+    ]
+
+    # the index is kept until any m3 collection item or animation id is added, removed, moved or changed
+    key = (ob.as_pointer(), ob.name)
+    collection_lens = tuple(len(collection) for collection in collections)
+    anim_id_paths = m3_anim_id_paths.get(key)
+    if anim_id_paths is not None and anim_id_paths[0] == shared.m3_collections_generation and anim_id_paths[1] == collection_lens:
+        return anim_id_paths[2]
+
+    hex_id_to_props = {}
+
+    def get_anim_ids(collection):
+        for item in collection:
+            for key in type(item).__annotations__.keys():
+                prop = getattr(item, key)
+                if type(prop) == shared.M3AnimHeaderProp:
+                    prop_path = prop.path_from_id()[:-7]  # removing the _header suffix
+                    prop_id_int = int(prop.hex_id, 16)
+                    try:
+                        hex_id_to_props[prop_id_int].append(prop_path)
+                    except KeyError:
+                        hex_id_to_props[prop_id_int] = [prop_path]
+                elif str(type(prop)) == '<class \'bpy_prop_collection_idprop\'>':
+                    get_anim_ids(prop)
+
+    for collection in collections:
+        get_anim_ids(collection)
+
+    m3_anim_id_paths[key] = [shared.m3_collections_generation, collection_lens, hex_id_to_props]
+
+    return hex_id_to_props
+
+
+def bl_data_count():
+    return sum(len(collection) for collection in (bpy.data.objects, bpy.data.meshes, bpy.data.armatures, bpy.data.actions))
+
+
+def m3_sections_decoded_count(m3):
+    if m3 is None:
+        return 0
+    # iterating the underlying list so that lazily loaded sections are not decoded by the count itself
+    return sum(1 for section in list.__iter__(m3) if section is not None)
+
+
+class ImportCache:
+    ''' Stores the blender independent data of imports on disk, keyed by file content and import options '''
+
+    version = 1
+
+    def __init__(self, directory=None, size_max=512 * 1048576):
+        self.directory = directory or bpy.utils.user_resource('DATAFILES', path='m3studio_import_cache', create=True)
+        self.size_max = size_max
+
+    def key(self, filepath, opts):
+        file_hash = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1048576), b''):
+                file_hash.update(chunk)
+        file_hash.update(repr((self.version, opts)).encode('ascii'))
+        return file_hash.hexdigest()
+
+    def get(self, key):
+        entry_path = os.path.join(self.directory, key + '.pickle')
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            os.remove(entry_path)  # entry is unreadable, most likely from an interrupted write
+            return None
+
+        # entries are evicted by least recent use
+        os.utime(entry_path)
+        return entry
+
+    def put(self, key, entry):
+        entry_path = os.path.join(self.directory, key + '.pickle')
+        with open(entry_path + '.tmp', 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(entry_path + '.tmp', entry_path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for file in os.scandir(self.directory):
+            if file.name.endswith('.pickle'):
+                stat = file.stat()
+                entries.append((stat.st_mtime, stat.st_size, file.path))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, entry_path in sorted(entries):
+            if size <= self.size_max:
+                break
+            os.remove(entry_path)
+            size -= entry_size
+
+
+def armature_object_new(scene):
     arm = bpy.data.armatures.new(name='Armature')
     ob = bpy.data.objects.new('Armature', arm)
     ob.location = scene.cursor.location
@@ -328,11 +463,47 @@ def armature_object_new():
 
 class Importer:
 
-    def __init__(self, bl_op=None):
+    def __init__(self, bl_op=None, profile=False, scene=None, headless=False):
         self.filepath = ''
         self.bl_op = bl_op
+        self.scene = scene or bpy.context.scene
+        self.view_layer = bpy.context.view_layer if self.scene == bpy.context.scene else self.scene.view_layers[0]
+        # when headless, work which only concerns the user interface, such as selection, is skipped
+        self.headless = headless
+        self.m3 = None
+        # data which was already prepared by a batch import worker, see io_m3_batch.file_preprocess
+        self.preprocessed_regions = {}
+        self.preprocessed_anim_keys = {}
         self.warn_strings = []
         self.exception_trace = ''
+        # list of per stage statistics, only collected when profiling
+        self.stage_stats = [] if profile else None
+
+    def stage_run(self, method, *args, **kwargs):
+        if self.stage_stats is None:
+            return method(*args, **kwargs)
+
+        bl_data_len = bl_data_count()
+        sections_len = m3_sections_decoded_count(self.m3)
+        tracemalloc.reset_peak()
+        memory_start = tracemalloc.get_traced_memory()[0]
+        time_start = time.perf_counter()
+
+        result = method(*args, **kwargs)
+
+        time_end = time.perf_counter()
+        memory_end, memory_peak = tracemalloc.get_traced_memory()
+
+        self.stage_stats.append({
+            'stage': method.__name__,
+            'time': time_end - time_start,
+            'memory': memory_end - memory_start,
+            'memory_peak': memory_peak - memory_start,
+            'bl_data': bl_data_count() - bl_data_len,
+            'sections_decoded': m3_sections_decoded_count(self.m3 if self.m3 is not None else result) - sections_len,
+        })
+
+        return result
 
     def do_report(self):
         if len(self.warn_strings):
@@ -348,135 +519,220 @@ class Importer:
                 self.bl_op.report({"ERROR"}, self.exception_trace)
         self.exception_trace = ''
 
-    def m3_import(self, filepath, ob=None, opts=None):
+        if self.stage_stats:
+            stage_strings = []
+            for stats in self.stage_stats:
+                stage_strings.append(
+                    f'{stats["stage"]}: {stats["time"]:.3f}s, {stats["memory"] / 1048576:.2f} MiB (peak {stats["memory_peak"] / 1048576:.2f} MiB), '
+                    f'{stats["bl_data"]} data-blocks, {stats["sections_decoded"]} sections decoded'
+                )
+            stats_report = f'M3 import stage statistics of {self.filepath}:\n' + '\n'.join(stage_strings)
+            print(stats_report)  # not for debugging
+            if self.bl_op:
+                self.bl_op.report({"INFO"}, stats_report)
+
+    def mode_set(self, ob, mode):
+        # the context is overridden so that the target scene does not need to be the one of the window, or for there to be a window
+        self.view_layer.objects.active = ob
+        if hasattr(bpy.context, 'temp_override'):
+            with bpy.context.temp_override(scene=self.scene, view_layer=self.view_layer, active_object=ob, object=ob):
+                bpy.ops.object.mode_set(mode=mode, toggle=False)
+        else:
+            bpy.ops.object.mode_set({'scene': self.scene, 'view_layer': self.view_layer, 'active_object': ob, 'object': ob}, mode=mode, toggle=False)
+
+    def fcurves_key(self, action_name, path, anim_data, interpolation, action_group=''):
+        # actions and their fcurves are indexed for the duration of the import so that
+        # neither bpy.data.actions nor action.fcurves need to be searched per track
+        action = self.action_map[action_name]
+        fcurve_index = self.action_fcurve_index.setdefault(action_name, {})
+
+        key_seqs = {}
+        fcurves = []
+        for index, index_data in enumerate(anim_data):
+            points_len = len(index_data) // 2
+
+            try:
+                interp_seq, key_sel_seq = key_seqs[points_len]
+            except KeyError:
+                interp_seq, key_sel_seq = key_seqs[points_len] = ([interpolation] * points_len, [False] * points_len)
+
+            fcurve = fcurve_index.get((path, index))
+            if fcurve is None:
+                fcurve = fcurve_index[(path, index)] = action.fcurves.new(path, index=index, action_group=action_group)
+                fcurve.select = False
+                keyframe_points = fcurve.keyframe_points
+                keyframe_points.add(points_len)
+                keyframe_points.foreach_set('co', index_data)
+                keyframe_points.foreach_set('interpolation', interp_seq)
+                keyframe_points.foreach_set('select_control_point', key_sel_seq)
+                keyframe_points.foreach_set('select_left_handle', key_sel_seq)
+                keyframe_points.foreach_set('select_right_handle', key_sel_seq)
+            else:
+                # keys of an existing fcurve are kept, the new keys are merged into it
+                self.warn_strings.append(f'Keys of {path}[{index}] in action {action_name} were given more than once and have been merged.')
+                keyframe_points = fcurve.keyframe_points
+                existing_len = len(keyframe_points)
+                existing_co = [0.0] * (existing_len * 2)
+                existing_interp = [0] * existing_len
+                keyframe_points.foreach_get('co', existing_co)
+                keyframe_points.foreach_get('interpolation', existing_interp)
+                all_sel_seq = [False] * (existing_len + points_len)
+                keyframe_points.add(points_len)
+                keyframe_points.foreach_set('co', existing_co + list(index_data))
+                keyframe_points.foreach_set('interpolation', existing_interp + interp_seq)
+                keyframe_points.foreach_set('select_control_point', all_sel_seq)
+                keyframe_points.foreach_set('select_left_handle', all_sel_seq)
+                keyframe_points.foreach_set('select_right_handle', all_sel_seq)
+                fcurve.update()
+            fcurves.append(fcurve)
+
+        return fcurves
+
+    def fcurve_remove(self, action_name, fcurve):
+        self.action_fcurve_index[action_name].pop((fcurve.data_path, fcurve.array_index), None)
+        self.action_map[action_name].fcurves.remove(fcurve)
+
+    def write_default_values(self):
+        # default values are collected during the import and written to the defaults action in a single pass
+        if not self.default_values:
+            return
+
+        if self.ob.m3_animations_default is None:
+            self.ob.m3_animations_default = bpy.data.actions.new(self.ob.name + '_DEFAULTS')
+
+        set_default_values(self.ob.m3_animations_default, self.default_values)
+        self.default_values = {}
+
+    def process_fields(self, io_method, bl, m3):
+        plan_key = (io_method, type(bl), m3.desc)
+        try:
+            raw_steps, steps = m3_input_plans[plan_key]
+        except KeyError:
+            raw_steps, steps = m3_input_plans[plan_key] = m3_input_plan_compile(io_method, type(bl), m3.desc)
+
+        if raw_steps:
+            bl.id_properties_ensure().update({target: convert(getattr(m3, field)) for target, field, convert in raw_steps})
+
+        processor = M3InputProcessor(self, bl, m3)
+        for method, args in steps:
+            method(processor, *args)
+
+    def m3_import(self, filepath, ob=None, opts=None, cache=None, preprocessed=None):
         self.filepath = filepath
+        self.preprocessed_regions, self.preprocessed_anim_keys = preprocessed or ({}, {})
         # TODO make fps an import option
-        bpy.context.scene.render.fps = FRAME_RATE
+        self.scene.render.fps = FRAME_RATE
 
         self.get_rig, self.get_anims, self.get_mesh, self.get_effects = opts if opts != None else [True] * 4
 
-        self.m3 = io_m3.M3SectionList.load(filepath)
+        # data which does not depend on blender is taken from the cache when the same file was imported with the same options
+        cache_key = cache.key(filepath, (self.get_rig, self.get_anims, self.get_mesh, self.get_effects)) if cache else None
+        cache_entry = cache.get(cache_key) if cache else None
+        self.cache_data = cache_entry['data'] if cache_entry else {'regions': {}, 'pose_keys': {}} if cache else None
+
+        if cache_entry:
+            self.m3 = self.stage_run(io_m3.M3SectionList.from_pickled, cache_entry['m3'])
+            self.m3.filepath = filepath
+        else:
+            # sections are decoded on first access, so that only those reachable from the selected options are read
+            self.m3 = self.stage_run(io_m3.M3SectionList.load, filepath, lazy=True)
         self.m3_model = self.m3[self.m3[0][0].model][0]
         self.m3_division = self.m3[self.m3_model.divisions][0]
 
         self.m3_bl_ref = {}
-        self.bl_ref_objects = []
+        self.bl_ref_objects = {}
         self.stc_id_data = {}
-        self.final_bone_names = {}
+        self.action_map = {}
+        self.action_fcurve_index = {}
+        self.action_stc_indices = {}
+        self.default_values = {}
+        self.m3_strings = {}
+        self.bone_names = None
 
         self.is_new_object = not ob
-        self.ob = ob or armature_object_new()
+        self.ob = ob or armature_object_new(self.scene)
 
         anims_len = len(self.ob.m3_animation_groups)
-        matref_len = len(self.ob.m3_materialrefs)
         self.anim_index = lambda x: anims_len + x
-        self.matref_index = lambda x: matref_len + x
+        self.matref_indices = {}
 
         self.m3_struct_version_set_from_ref('m3_model_version', self.m3[0][0].model)
 
         if self.get_rig:
             if self.get_anims:
-                self.create_animations()
-
-            self.create_bones()
-            self.create_attachments()
-            self.create_hittests()
-            self.create_rigid_bodies()
-            self.create_rigid_body_joints()
-            self.create_cameras()
-            self.create_billboards()
-            self.create_ik_joints()
-            self.create_turrets()
-            self.create_shadow_boxes()
-            self.create_tmd()
+                self.stage_run(self.create_animations)
+
+            self.stage_run(self.create_bones)
+            self.stage_run(self.create_attachments)
+            self.stage_run(self.create_hittests)
+            self.stage_run(self.create_rigid_bodies)
+            self.stage_run(self.create_rigid_body_joints)
+            self.stage_run(self.create_cameras)
+            self.stage_run(self.create_billboards)
+            self.stage_run(self.create_ik_joints)
+            self.stage_run(self.create_turrets)
+            self.stage_run(self.create_shadow_boxes)
+            self.stage_run(self.create_tmd)
 
         if self.get_rig and self.get_mesh:
-            self.create_bounding()
+            self.stage_run(self.create_bounding)
 
         if self.get_mesh or self.get_effects:
-            self.create_materials()
+            self.stage_run(self.create_materials)
 
         if self.get_mesh:
-            self.create_mesh()
+            self.stage_run(self.create_mesh)
 
         if self.get_mesh and self.get_rig:
-            self.create_cloths()
+            self.stage_run(self.create_cloths)
 
         if self.get_effects:
-            self.create_lights()
-            self.create_particles()
-            self.create_ribbons()
-            self.create_projections()
-            self.create_forces()
-            self.create_warps()
+            self.stage_run(self.create_lights)
+            self.stage_run(self.create_particles)
+            self.stage_run(self.create_ribbons)
+            self.stage_run(self.create_projections)
+            self.stage_run(self.create_forces)
+            self.stage_run(self.create_warps)
+
+        self.stage_run(self.write_default_values)
 
         if self.is_new_object:
-            ob_anim_data_set(bpy.context.scene, self.ob, None)
-            bpy.context.view_layer.objects.active = self.ob
-            self.ob.select_set(True)
+            ob_anim_data_set(self.scene, self.ob, None)
+            if not self.headless:
+                self.view_layer.objects.active = self.ob
+                self.ob.select_set(True)
 
-        # lazy way to filter out materials unused by the imported data, but it works
-        user_matref_index = self.ob.m3_materialrefs_index
-        for ii in reversed(range(len(self.ob.m3_materialrefs))[matref_len:]):
-            self.ob.m3_materialrefs_index = ii
-            bpy.ops.m3.material_remove('INVOKE_DEFAULT', quiet=True)
-        self.ob.m3_materialrefs_index = user_matref_index
+        if cache and not cache_entry:
+            self.stage_run(cache.put, cache_key, {'m3': pickle.dumps(self.m3, protocol=pickle.HIGHEST_PROTOCOL), 'data': self.cache_data})
 
     def m3a_import(self, filepath, ob):
-
-        def get_m3_id_props():
-            hex_id_to_props = {}
-
-            collections = [
-                ob.m3_cameras, ob.m3_forces, ob.m3_lights, ob.m3_materiallayers, ob.m3_materials_standard, ob.m3_materials_displacement,
-                ob.m3_materials_composite, ob.m3_materials_volume, ob.m3_materials_volumenoise, ob.m3_materials_reflection, ob.m3_materials_lensflare,
-                ob.m3_particlesystems, ob.m3_particlecopies, ob.m3_projections, ob.m3_ribbons, ob.m3_ribbonsplines, ob.m3_shadowboxes, ob.m3_warps,
-            ]
-
-            def get_anim_ids(collection):
-                for item in collection:
-                    for key in type(item).__annotations__.keys():
-                        prop = getattr(item, key)
-                        if type(prop) == shared.M3AnimHeaderProp:
-                            prop_path = prop.path_from_id()[:-7]  # removing the _header suffix
-                            prop_id_int = int(prop.hex_id, 16)
-                            try:
-                                hex_id_to_props[prop_id_int].append(prop_path)
-                            except KeyError:
-                                hex_id_to_props[prop_id_int] = [prop_path]
-                        elif str(type(prop)) == '<class \'bpy_prop_collection_idprop\'>':
-                            get_anim_ids(prop)
-
-            for collection in collections:
-                get_anim_ids(collection)
-
-            return hex_id_to_props
-
         # TODO make fps an import options
-        bpy.context.scene.render.fps = FRAME_RATE
-        ob_anim_data_set(bpy.context.scene, ob, None)
+        self.scene.render.fps = FRAME_RATE
+        ob_anim_data_set(self.scene, ob, None)
 
         self.is_new_object = False
         self.ob = ob
-        self.m3 = io_m3.M3SectionList.load(filepath)
+        self.cache_data = None
+        self.m3 = self.stage_run(io_m3.M3SectionList.load, filepath, lazy=True)
         self.m3_model = self.m3[self.m3[0][0].model][0]
         self.stc_id_data = {}
+        self.action_map = {}
+        self.action_fcurve_index = {}
+        self.action_stc_indices = {}
+        self.default_values = {}
+        self.m3_strings = {}
 
         anims_len = len(self.ob.m3_animation_groups)
         self.anim_index = lambda x: anims_len + x
-        self.create_animations()
 
-        m3_id_prop_paths = get_m3_id_props()
+        m3_id_prop_paths = self.stage_run(anim_id_paths_get, ob)
 
-        for anim_id_data, paths in m3_id_prop_paths.items():
-            rs = paths[0].rsplit('.', 1)
-            prop = ob.path_resolve(paths[0])
-            try:  # put prop in a tuple if it is not already
-                key_fcurves(self.stc_id_data, ob.path_resolve(rs[0]), rs[1], ob.path_resolve(paths[0] + '_header'), prop)
-            except TypeError:
-                key_fcurves(self.stc_id_data, ob.path_resolve(rs[0]), rs[1], ob.path_resolve(paths[0] + '_header'), (prop,))
+        # the defaults of all animated properties are recorded before any of the animation data is read
+        for paths in m3_id_prop_paths.values():
+            self.m3a_key_prop(paths[0])
 
         bind_mats = {}
+        pose_bone_args = []
         for pb in ob.pose.bones:
             db = ob.data.bones.get(pb.name)
 
@@ -503,7 +759,32 @@ class Importer:
             left_in_mat = rel_mat if not pb.parent else rel_mat @ io_shared.rot_fix_matrix_transpose @ bind_mats[pb.parent].inverted()
             right_in_mat = bind_mat @ io_shared.rot_fix_matrix
 
-            self.animate_pose_bone(anim_ids, defaults, pb, left_in_mat, right_in_mat)
+            pose_bone_args.append((None, anim_ids, defaults, pb, left_in_mat, right_in_mat))
+
+        def apply_stc():
+            # each sequence transformation collection is applied as soon as it is read, then its data is discarded
+            for anim_id in self.stc_id_data.keys():
+                paths = m3_id_prop_paths.get(anim_id)
+                if paths:
+                    self.m3a_key_prop(paths[0])
+
+            for args in pose_bone_args:
+                if any(anim_id in self.stc_id_data for anim_id in args[1]):
+                    self.animate_pose_bone(*args)
+
+            self.stc_id_data = {}
+
+        self.stage_run(self.create_animations, apply_stc=apply_stc)
+        self.stage_run(self.write_default_values)
+
+    def m3a_key_prop(self, path):
+        ob = self.ob
+        rs = path.rsplit('.', 1)
+        prop = ob.path_resolve(path)
+        try:  # put prop in a tuple if it is not already
+            key_fcurves(self, ob.path_resolve(rs[0]), rs[1], ob.path_resolve(path + '_header'), prop)
+        except TypeError:
+            key_fcurves(self, ob.path_resolve(rs[0]), rs[1], ob.path_resolve(path + '_header'), (prop,))
 
     def m3_struct_version_set_from_ref(self, version_attr, ref):
 
@@ -519,19 +800,25 @@ class Importer:
             else:
                 setattr(self.ob, version_attr, str(version_val))
 
+    def m3_string(self, ref):
+        # each CHAR section is decoded once per import
+        try:
+            return self.m3_strings[ref.index]
+        except KeyError:
+            string = self.m3_strings[ref.index] = self.m3[ref].content_to_string() if ref.index and ref.entries else ''
+            return string
+
     def m3_get_bone_name(self, bone_index):
         if bone_index < 0:
             return None
 
-        imported_bone_name = self.final_bone_names.get(bone_index)
-
-        if imported_bone_name:
-            return imported_bone_name
+        # bone names are those of the m3 file until create_bones replaces them with the names of the created bones
+        if self.bone_names is None:
+            self.bone_names = [self.m3_string(m3_bone.name) for m3_bone in self.m3[self.m3_model.bones]]
 
-        m3_bone = self.m3[self.m3_model.bones][bone_index]
-        return self.m3[m3_bone.name].content_to_string()
+        return self.bone_names[bone_index]
 
-    def animate_pose_bone(self, anim_ids, defaults, pose_bone, left_mat, right_mat):
+    def animate_pose_bone(self, bone_index, anim_ids, defaults, pose_bone, left_mat, right_mat):
         id_data_loc = self.stc_id_data.get(anim_ids[0], {})
         id_data_rot = self.stc_id_data.get(anim_ids[1], {})
         id_data_scl = self.stc_id_data.get(anim_ids[2], {})
@@ -562,49 +849,23 @@ class Importer:
             if not anim_frames_set:
                 return
 
+            if self.cache_data is not None:
+                cache_key = (bone_index, self.action_stc_indices[action_name])
+                cached_anim_data = self.cache_data['pose_keys'].get(cache_key)
+                if cached_anim_data:
+                    anim_data_nones = (anim_data_loc_none, anim_data_rot_none, anim_data_scl_none)
+                    for field, anim_data_none, new_anim_data in zip(('location', 'rotation_quaternion', 'scale'), anim_data_nones, cached_anim_data):
+                        if not anim_data_none:
+                            self.fcurves_key(action_name, pose_bone.path_from_id(field), new_anim_data, 1, action_group=pose_bone.name)
+                    continue
+
             # we put in original data first so that we can evaluate the fcurves.
             # blender interpolates the data we need to apply the correction matrices for us.
             # * can we interpolate based on interpolation of m3 anim header?
-            fcurves = bpy.data.actions.get(action_name).fcurves
             # store fcurve references so that we don't have to find them later
-            fcurves_loc = []
-            for index, index_data in enumerate(anim_data_loc):
-                points_len = len(index_data) // 2
-                fcurve = fcurves.new(pose_bone.path_from_id('location'), index=index, action_group=pose_bone.name)
-                fcurve.select = False
-                fcurve.keyframe_points.add(points_len)
-                fcurve.keyframe_points.foreach_set('co', index_data)
-                fcurve.keyframe_points.foreach_set('interpolation', [1] * points_len)
-                fcurve.keyframe_points.foreach_set('select_control_point', key_sel := [False] * points_len)
-                fcurve.keyframe_points.foreach_set('select_left_handle', key_sel)
-                fcurve.keyframe_points.foreach_set('select_right_handle', key_sel)
-                fcurves_loc.append(fcurve)
-
-            fcurves_rot = []
-            for index, index_data in enumerate(anim_data_rot):
-                points_len = len(index_data) // 2
-                fcurve = fcurves.new(pose_bone.path_from_id('rotation_quaternion'), index=index, action_group=pose_bone.name)
-                fcurve.select = False
-                fcurve.keyframe_points.add(points_len)
-                fcurve.keyframe_points.foreach_set('co', index_data)
-                fcurve.keyframe_points.foreach_set('interpolation', [1] * points_len)
-                fcurve.keyframe_points.foreach_set('select_control_point', key_sel := [False] * points_len)
-                fcurve.keyframe_points.foreach_set('select_left_handle', key_sel)
-                fcurve.keyframe_points.foreach_set('select_right_handle', key_sel)
-                fcurves_rot.append(fcurve)
-
-            fcurves_scl = []
-            for index, index_data in enumerate(anim_data_scl):
-                points_len = len(index_data) // 2
-                fcurve = fcurves.new(pose_bone.path_from_id('scale'), index=index, action_group=pose_bone.name)
-                fcurve.select = False
-                fcurve.keyframe_points.add(points_len)
-                fcurve.keyframe_points.foreach_set('co', index_data)
-                fcurve.keyframe_points.foreach_set('interpolation', [1] * points_len)
-                fcurve.keyframe_points.foreach_set('select_control_point', key_sel := [False] * points_len)
-                fcurve.keyframe_points.foreach_set('select_left_handle', key_sel)
-                fcurve.keyframe_points.foreach_set('select_right_handle', key_sel)
-                fcurves_scl.append(fcurve)
+            fcurves_loc = self.fcurves_key(action_name, pose_bone.path_from_id('location'), anim_data_loc, 1, action_group=pose_bone.name)
+            fcurves_rot = self.fcurves_key(action_name, pose_bone.path_from_id('rotation_quaternion'), anim_data_rot, 1, action_group=pose_bone.name)
+            fcurves_scl = self.fcurves_key(action_name, pose_bone.path_from_id('scale'), anim_data_scl, 1, action_group=pose_bone.name)
 
             new_anim_data = [[], [], []]
             pre_rot = None
@@ -633,24 +894,27 @@ class Importer:
             new_anim_data_rot = m3_key_collect_quat(anim_frames[1], new_anim_data[1])
             new_anim_data_scl = m3_key_collect_vec3(anim_frames[2], new_anim_data[2])
 
+            if self.cache_data is not None:
+                self.cache_data['pose_keys'][cache_key] = (new_anim_data_loc, new_anim_data_rot, new_anim_data_scl)
+
             for index, index_data in enumerate(new_anim_data_loc):
                 fcurve = fcurves_loc[index]
                 if anim_data_loc_none:
-                    fcurves.remove(fcurve)
+                    self.fcurve_remove(action_name, fcurve)
                 else:
                     fcurve.keyframe_points.foreach_set('co', index_data)
 
             for index, index_data in enumerate(new_anim_data_rot):
                 fcurve = fcurves_rot[index]
                 if anim_data_rot_none:
-                    fcurves.remove(fcurve)
+                    self.fcurve_remove(action_name, fcurve)
                 else:
                     fcurve.keyframe_points.foreach_set('co', index_data)
 
             for index, index_data in enumerate(new_anim_data_scl):
                 fcurve = fcurves_scl[index]
                 if anim_data_scl_none:
-                    fcurves.remove(fcurve)
+                    self.fcurve_remove(action_name, fcurve)
                 else:
                     fcurve.keyframe_points.foreach_set('co', index_data)
 
@@ -658,17 +922,10 @@ class Importer:
         id_data_render = self.stc_id_data.get(anim_ids[3], {})
 
         if id_data_render:
-            for action_name in id_data_render.keys():
-                action = bpy.data.actions.get(action_name)
-                key_frame_points_len = len(id_data_render[action_name][0]) // 2
-
-                fcurve = action.fcurves.new(pose_bone.path_from_id('m3_batching'), action_group=pose_bone.name)
-                fcurve.select = False
-                fcurve.keyframe_points.add(key_frame_points_len)
-                fcurve.keyframe_points.foreach_set('co', id_data_render[action_name][0])
-                fcurve.keyframe_points.foreach_set('interpolation', [0] * key_frame_points_len)
+            for action_name, anim_data_render in id_data_render.items():
+                self.fcurves_key(action_name, pose_bone.path_from_id('m3_batching'), anim_data_render[:1], 0, action_group=pose_bone.name)
 
-    def create_animations(self):
+    def create_animations(self, apply_stc=None):
         ob = self.ob
 
         if self.is_new_object:
@@ -678,10 +935,9 @@ class Importer:
         ob.m3_options.update_anim_data = False
 
         for m3_seq, m3_stg in zip(self.m3[self.m3_model.sequences], self.m3[self.m3_model.sequence_transformation_groups]):
-            anim_group_name = self.m3[m3_seq.name].content_to_string()
+            anim_group_name = self.m3_string(m3_seq.name)
             anim_group = shared.m3_item_add(ob.m3_animation_groups, anim_group_name)
-            seq_processor = M3InputProcessor(self, anim_group, m3_seq)
-            io_shared.io_anim_group(seq_processor)
+            self.process_fields(io_shared.io_anim_group, anim_group, m3_seq)
 
             anim_group['frame_start'] = to_bl_frame(m3_seq.anim_ms_start)
             anim_group['frame_end'] = to_bl_frame(m3_seq.anim_ms_end)
@@ -692,51 +948,48 @@ class Importer:
                 if not m3_stc.name.index:
                     continue
 
-                anim_name = self.m3[m3_stc.name].content_to_string().replace(anim_group_name, '')[1:]
+                anim_name = self.m3_string(m3_stc.name).replace(anim_group_name, '')[1:]
                 anim = shared.m3_item_add(anim_group.animations, anim_name)
                 anim['concurrent'] = m3_stc.concurrent
                 anim['priority'] = m3_stc.priority
                 anim.action = bpy.data.actions.new(f'{ob.name}_{anim_group.name}_{anim.name}')
+                self.action_map[anim.action.name] = anim.action
+                self.action_stc_indices[anim.action.name] = m3_stc_index
 
-                m3_key_type_collection_list = [
-                    m3_stc.sdev, m3_stc.sd2v, m3_stc.sd3v, m3_stc.sd4q, m3_stc.sdcc, m3_stc.sdr3, m3_stc.sdu8,
-                    m3_stc.sds6, m3_stc.sdu6, m3_stc.sds3, m3_stc.sdu3, m3_stc.sdfg, m3_stc.sdmb,
-                ]
+                m3_key_type_collection_list = io_m3_batch.stc_key_type_collections(m3_stc)
+
+                stc_sections = [m3_stc.anim_ids.index, m3_stc.anim_refs.index]
 
                 for stc_id, stc_ref in zip(self.m3[m3_stc.anim_ids], self.m3[m3_stc.anim_refs]):
                     anim_type = stc_ref >> 16
-                    anim_index = stc_ref & 0xffff
-                    m3_key_type_collection = m3_key_type_collection_list[anim_type]
-                    m3_key_entries = self.m3[m3_key_type_collection][anim_index]
-
-                    frames = []
-                    ignored_indices = []
-                    for ii, ms in enumerate(self.m3[m3_key_entries.frames]):
-                        frame = to_bl_frame(ms)
-                        if frame not in frames:
-                            frames.append(frame)
-                        else:
-                            frames[-1] = frame
-                            ignored_indices.append(ii - 1)
-
-                    m3_keys = self.m3[m3_key_entries.keys]
-                    keys = [m3_keys[ii] for ii in range(len(m3_keys)) if ii not in ignored_indices]
+                    anim_keys = self.preprocessed_anim_keys.get((m3_stc_index, stc_ref))
+
+                    if anim_keys is None:
+                        m3_key_entries = self.m3[m3_key_type_collection_list[anim_type]][stc_ref & 0xffff]
+                        stc_sections.extend((m3_key_entries.frames.index, m3_key_entries.keys.index))
+                        frames, keys = io_m3_batch.anim_keys_get(self.m3, m3_key_entries)
+                        anim_keys = io_m3_batch.m3_key_type_collection_method[anim_type](frames, keys)
 
                     try:
-                        self.stc_id_data[stc_id][anim.action.name] = m3_key_type_collection_method[anim_type](frames, keys)
+                        self.stc_id_data[stc_id][anim.action.name] = anim_keys
                     except KeyError:
                         self.stc_id_data[stc_id] = {}
-                        self.stc_id_data[stc_id][anim.action.name] = m3_key_type_collection_method[anim_type](frames, keys)
+                        self.stc_id_data[stc_id][anim.action.name] = anim_keys
 
                     # consider making a dedicated property type and collection list for events
-                    if m3_key_type_collection == m3_stc.sdev:
+                    if anim_type == 0:
                         for ii, frame in enumerate(frames):
                             key = keys[ii]
-                            event_name = self.m3[key.name].content_to_string()
+                            event_name = self.m3_string(key.name)
                             if event_name == 'Evt_Simulate':
                                 anim_group['simulate'] = True
                                 anim_group['simulate_frame'] = frame
 
+                if apply_stc:
+                    apply_stc()
+                    for section_index in stc_sections:
+                        self.m3.discard(section_index)
+
             anim_group['animations_index'] = len(anim_group.animations) - 1
 
         ob.m3_options.update_anim_data = update_anim_lock
@@ -744,77 +997,77 @@ class Importer:
     def create_bones(self):
 
         def get_bone_tails(m3_bones, bone_heads, bone_vectors):
-            child_bone_indices = [[] for ii in m3_bones]
-            for bone_index, bone_entry in enumerate(m3_bones):
-                if bone_entry.parent != -1:
-                    child_bone_indices[bone_entry.parent].append(bone_index)
-
-            tails = []
-
-            for m3_bone, child_indices, head, vector in zip(m3_bones, child_bone_indices, bone_heads, bone_vectors):
-                length = 0.1
-                for child_index in child_indices:
-                    head_to_child_head = bone_heads[child_index] - head
-                    if head_to_child_head.length >= 0.01 and abs(head_to_child_head.angle(vector)) < 0.1:
-                        length = head_to_child_head.length
-                tail_offset = length * vector
-                tail = head + tail_offset
-                while (tail - head).length == 0:
-                    tail_offset *= 2
-                    tail = head + tail_offset
-                tails.append(tail)
+            parents = np.array([m3_bone.parent for m3_bone in m3_bones], dtype=np.int64)
+            children = np.flatnonzero(parents != -1)
+            parents = parents[children]
+
+            head_to_child_heads = bone_heads[children] - bone_heads[parents]
+            lengths = np.linalg.norm(head_to_child_heads, axis=1)
+            with np.errstate(invalid='ignore'):
+                valid = (lengths >= 0.01) & (np.abs(np_vector_angles(head_to_child_heads, bone_vectors[parents])) < 0.1)
+
+            # the last valid child of each bone determines its length
+            last_child = np.full(len(m3_bones), -1, dtype=np.int64)
+            np.maximum.at(last_child, parents[valid], children[valid])
+            has_child = last_child != -1
+
+            tail_lengths = np.full(len(m3_bones), 0.1)
+            tail_lengths[has_child] = np.linalg.norm(bone_heads[last_child[has_child]] - bone_heads[has_child], axis=1)
+
+            tail_offsets = bone_vectors * tail_lengths[:, None]
+            tails = bone_heads + tail_offsets
+            collapsed = np.all(tails == bone_heads, axis=1) & np.any(tail_offsets != 0, axis=1)
+            while collapsed.any():
+                tail_offsets[collapsed] *= 2
+                tails[collapsed] = bone_heads[collapsed] + tail_offsets[collapsed]
+                collapsed &= np.all(tails == bone_heads, axis=1)
 
             return tails
 
         def get_bone_rolls(bone_rests, bone_heads, bone_tails):
-            rolls = []
-            for iref, head, tail in zip(bone_rests, bone_heads, bone_tails):
-                v = (tail - head).normalized()
-                target = mathutils.Vector((0, 1, 0))
-                axis = target.cross(v)
-                if axis.dot(axis) > 0.000001:
-                    axis.normalize()
-                    theta = target.angle(v)
-                    b_matrix = mathutils.Matrix.Rotation(theta, 3, axis)
-                else:
-                    sign = 1 if target.dot(v) > 0 else -1
-                    b_matrix = mathutils.Matrix((
-                        (sign, 0, 0),
-                        (0, sign, 0),
-                        (0, 0, 1),
-                    ))
-
-                rot_matrix = mathutils.Matrix.Rotation(0, 3, v) @ b_matrix
-                rot_matrix = rot_matrix.to_4x4()
-                rot_matrix.translation = head
-                matrix33 = rot_matrix.to_3x3()
-
-                z_x = matrix33.col[2].angle(iref.col[0].to_3d())
-                z_z = matrix33.col[2].angle(iref.col[2].to_3d())
-
-                roll_angle = z_z if z_x > math.pi / 2 else -z_z
-                rolls.append(roll_angle)
-
-            return rolls
+            with np.errstate(divide='ignore', invalid='ignore'):
+                v = bone_tails - bone_heads
+                v /= np.linalg.norm(v, axis=1)[:, None]
+
+            # axis of rotation from the y axis to each bone vector, which is the cross product (0, 1, 0) x v
+            axis = np.stack((v[:, 2], np.zeros(len(v)), -v[:, 0]), axis=1)
+            aligned = np.einsum('ij,ij->i', axis, axis) <= 0.000001
+            with np.errstate(divide='ignore', invalid='ignore'):
+                axis /= np.linalg.norm(axis, axis=1)[:, None]
+            theta = np.arccos(np.clip(v[:, 1], -1, 1))
+
+            # third column of the rotation matrix of theta about axis
+            cos, sin = np.cos(theta), np.sin(theta)
+            z_cols = axis * (axis[:, 2] * (1 - cos))[:, None]
+            z_cols[:, 0] += sin * axis[:, 1]
+            z_cols[:, 1] -= sin * axis[:, 0]
+            z_cols[:, 2] += cos
+            z_cols[aligned] = (0, 0, 1)
+
+            z_x = np_vector_angles(z_cols, bone_rests[:, 0:3, 0])
+            z_z = np_vector_angles(z_cols, bone_rests[:, 0:3, 2])
+
+            return np.where(z_x > math.pi / 2, z_z, -z_z)
 
         def get_edit_bones(m3_bones, bone_heads, bone_tails, bone_rolls):
             edit_bones = []
+            bone_names = []
 
-            for index, m3_bone in enumerate(m3_bones):
-                m3_bone_name = self.m3[m3_bone.name].content_to_string()
-                edit_bone = self.ob.data.edit_bones.new(m3_bone_name)
-                self.final_bone_names[index] = edit_bone.name
+            for m3_bone in m3_bones:
+                edit_bone = self.ob.data.edit_bones.new(self.m3_string(m3_bone.name))
+                bone_names.append(edit_bone.name)
                 edit_bones.append(edit_bone)
 
-            for index, m3_bone in enumerate(m3_bones):
-                edit_bone = edit_bones[index]
-                edit_bone.head = bone_heads[index]
-                edit_bone.tail = bone_tails[index]
-                edit_bone.roll = bone_rolls[index]
+            self.bone_names = bone_names
+
+            for m3_bone, edit_bone, head, tail, roll in zip(m3_bones, edit_bones, bone_heads.tolist(), bone_tails.tolist(), bone_rolls.tolist()):
+                edit_bone.head = head
+                edit_bone.tail = tail
+                edit_bone.roll = roll
                 edit_bone.select_tail = False
 
                 if m3_bone.parent != -1:
-                    parent_edit_bone = self.ob.data.edit_bones[m3_bone.parent]
+                    parent_edit_bone = edit_bones[m3_bone.parent]
                     edit_bone.parent = parent_edit_bone
                     parent_child_vector = parent_edit_bone.tail - edit_bone.head
 
@@ -829,23 +1082,20 @@ class Importer:
             return edit_bones
 
         def get_edit_bone_relations(m3_bones, edit_bones):
-            rel_mats = []
-            for m3_bone, edit_bone in zip(m3_bones, edit_bones):
+            edit_mats = np.array([edit_bone.matrix for edit_bone in edit_bones], dtype=np.float64).reshape(-1, 4, 4)
+            edit_mats_inv = np.linalg.inv(edit_mats)
 
-                if m3_bone.parent != -1:
-                    parent_edit_bone = self.ob.data.edit_bones.get(self.m3_get_bone_name(m3_bone.parent))
-                    rel_mats.append((parent_edit_bone.matrix.inverted() @ edit_bone.matrix).inverted())
-                else:
-                    rel_mats.append(edit_bone.matrix.inverted())
+            # (parent.inverted() @ child).inverted() is child.inverted() @ parent
+            rel_mats = edit_mats_inv.copy()
+            parents = np.array([m3_bone.parent for m3_bone in m3_bones], dtype=np.int64)
+            children = np.flatnonzero(parents != -1)
+            rel_mats[children] = edit_mats_inv[children] @ edit_mats[parents[children]]
 
-            return rel_mats
+            return [mathutils.Matrix(rel_mat) for rel_mat in rel_mats.tolist()]
 
         def adjust_pose_bones(m3_bones, edit_bone_relations, bind_scales, bind_matrices):
             for ii, m3_bone, rel_mat, bind_scl, bind_mat in zip(range(len(m3_bones)), m3_bones, edit_bone_relations, bind_scales, bind_matrices):
 
-                if m3_bone.parent != -1:
-                    bind_mat.transpose()
-
                 left_mat = rel_mat if m3_bone.parent == -1 else rel_mat @ io_shared.rot_fix_matrix_transpose @ bind_matrices[m3_bone.parent].inverted()
                 right_mat = bind_mat @ io_shared.rot_fix_matrix
                 bone_mat_comp = to_bl_vec3(m3_bone.location.default), to_bl_quat(m3_bone.rotation.default), to_bl_vec3(m3_bone.scale.default)
@@ -868,65 +1118,75 @@ class Importer:
                 m3_anim_ids = (m3_bone.location.header.id, m3_bone.rotation.header.id, m3_bone.scale.header.id, m3_bone.batching.header.id)
                 m3_defaults = (m3_bone.location.default, m3_bone.rotation.default, m3_bone.scale.default)
 
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('location'), 0, pose_bone.location[0])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('location'), 1, pose_bone.location[1])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('location'), 2, pose_bone.location[2])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('rotation_quaternion'), 0, pose_bone.rotation_quaternion[0])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('rotation_quaternion'), 1, pose_bone.rotation_quaternion[1])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('rotation_quaternion'), 2, pose_bone.rotation_quaternion[2])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('rotation_quaternion'), 3, pose_bone.rotation_quaternion[3])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('scale'), 0, pose_bone.scale[0])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('scale'), 1, pose_bone.scale[1])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('scale'), 2, pose_bone.scale[2])
-                set_default_value(self.ob.m3_animations_default, pose_bone.path_from_id('m3_batching'), 0, pose_bone.m3_batching)
-                self.animate_pose_bone(m3_anim_ids, m3_defaults, pose_bone, left_mat, right_mat)
-
-        bpy.context.view_layer.objects.active = self.ob
-
-        bone_rests = []
-        bind_scales = []
-        bind_matrices = []
-        bone_heads = []
-        bone_vectors = []
+                for field in ('location', 'rotation_quaternion', 'scale'):
+                    path = pose_bone.path_from_id(field)
+                    for index, value in enumerate(getattr(pose_bone, field)):
+                        self.default_values[(path, index)] = value
+                self.default_values[(pose_bone.path_from_id('m3_batching'), 0)] = pose_bone.m3_batching
+                self.animate_pose_bone(ii, m3_anim_ids, m3_defaults, pose_bone, left_mat, right_mat)
 
         m3_bones = self.m3[self.m3_model.bones]
+        m3_bone_rests = self.m3[self.m3_model.bone_rests]
+        mats = to_np_matrices(m3_bone_rests, min(len(m3_bones), len(m3_bone_rests)))
+        m3_bones = m3_bones[:len(mats)]
 
-        for iref, m3_bone in zip(self.m3[self.m3_model.bone_rests], m3_bones):
-            mat = to_bl_matrix(iref.matrix)
-            mat_scale = mat.to_scale()
+        # the scale sign of each matrix, as given by blender's decomposition, is negative for all axes when the determinant is
+        mat_signs = np.where(np.linalg.det(mats[:, 0:3, 0:3]) < 0, -1.0, 1.0)
 
-            # TODO replace this with a correction on the pose data
-            for ii in range(3):
-                if mat_scale[ii] < 0:
-                    mat[ii] = -mat[ii]
+        # TODO replace this with a correction on the pose data
+        mats[:, 0:3] *= mat_signs[:, None, None]
 
-            try:
-                bone_rests.append(mat.inverted() @ io_shared.rot_fix_matrix)
-            except ValueError:
-                bone_rests.append(mathutils.Matrix() @ io_shared.rot_fix_matrix)
-
-            # calculating scale vector manually since for some reason blender tends to come up with something else.
-            # still using blender's scale calculation to get the sign of the scale tho.
-            bind_scale = mathutils.Vector((
-                mathutils.Vector(mat[0][0:3]).length * (-1 if mat_scale[0] < 0 else 1),
-                mathutils.Vector(mat[1][0:3]).length * (-1 if mat_scale[1] < 0 else 1),
-                mathutils.Vector(mat[2][0:3]).length * (-1 if mat_scale[2] < 0 else 1),
-            ))
-
-            bind_scales.append(bind_scale)
-            bind_matrices.append(mathutils.Matrix.LocRotScale(None, None, bind_scale))
-            bone_heads.append(bone_rests[-1].translation)
-            bone_vectors.append(bone_rests[-1].col[1].to_3d().normalized())
+        invertible = np.linalg.det(mats) != 0
+        bone_rests = np.broadcast_to(np.identity(4), mats.shape).copy()
+        bone_rests[invertible] = np.linalg.inv(mats[invertible])
+        bone_rests = bone_rests @ np.array(io_shared.rot_fix_matrix)
+
+        # calculating scale vector manually since for some reason blender tends to come up with something else.
+        bind_scales = np.linalg.norm(mats[:, 0:3, 0:3], axis=2) * mat_signs[:, None]
+        bind_scales = bind_scales.tolist()
+        bind_matrices = [mathutils.Matrix.LocRotScale(None, None, bind_scale) for bind_scale in bind_scales]
+
+        bone_heads = bone_rests[:, 0:3, 3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bone_vectors = bone_rests[:, 0:3, 1] / np.linalg.norm(bone_rests[:, 0:3, 1], axis=1)[:, None]
+        bone_vectors = np.nan_to_num(bone_vectors)
 
         bone_tails = get_bone_tails(m3_bones, bone_heads, bone_vectors)
         bone_rolls = get_bone_rolls(bone_rests, bone_heads, bone_tails)
-        bpy.ops.object.mode_set(mode='EDIT', toggle=False)
+        self.mode_set(self.ob, 'EDIT')
         edit_bones = get_edit_bones(m3_bones, bone_heads, bone_tails, bone_rolls)
         edit_bone_relations = get_edit_bone_relations(m3_bones, edit_bones)
-        bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
+        self.mode_set(self.ob, 'OBJECT')
 
         adjust_pose_bones(m3_bones, edit_bone_relations, bind_scales, bind_matrices)
 
+    def get_used_matref_indices(self):
+        m3_matrefs = self.m3[self.m3_model.material_references]
+        used_indices = set()
+
+        if self.get_mesh:
+            for batch in self.m3[self.m3_division.batches]:
+                used_indices.add(batch.material_reference_index)
+
+        if self.get_effects:
+            for field in ['particle_systems', 'ribbons', 'projections']:
+                for m3_item in self.m3[getattr(self.m3_model, field)]:
+                    used_indices.add(m3_item.material_reference_index)
+
+        # composite materials pull in the materials of their sections, which may themselves be composite
+        pending_indices = list(used_indices)
+        while pending_indices:
+            m3_matref = m3_matrefs[pending_indices.pop()]
+            if m3_matref.type != 3:
+                continue
+            m3_mat = self.m3[getattr(self.m3_model, shared.material_type_to_model_reference[m3_matref.type])][m3_matref.material_index]
+            for m3_section in self.m3[m3_mat.sections]:
+                if m3_section.material_reference_index not in used_indices:
+                    used_indices.add(m3_section.material_reference_index)
+                    pending_indices.append(m3_section.material_reference_index)
+
+        return sorted(used_indices)
+
     def create_materials(self):
         ob = self.ob
 
@@ -949,15 +1209,20 @@ class Importer:
         if hasattr(self.m3_model, 'materials_lensflare'):
             self.m3_struct_version_set_from_ref('m3_materials_lensflare_version', self.m3_model.materials_lensflare)
 
+        m3_matrefs = self.m3[self.m3_model.material_references]
+        used_matref_indices = self.get_used_matref_indices()
+        matref_len = len(ob.m3_materialrefs)
+        self.matref_indices = {m3_matref_index: matref_len + ii for ii, m3_matref_index in enumerate(used_matref_indices)}
+
         layer_section_to_index = {}
-        for m3_matref in self.m3[self.m3_model.material_references]:
+        for m3_matref_index in used_matref_indices:
+            m3_matref = m3_matrefs[m3_matref_index]
             m3_mat = self.m3[getattr(self.m3_model, shared.material_type_to_model_reference[m3_matref.type])][m3_matref.material_index]
             mat_col = getattr(ob, shared.material_collections[m3_matref.type])
-            matref = shared.m3_item_add(ob.m3_materialrefs, item_name=self.m3[m3_mat.name].content_to_string())
+            matref = shared.m3_item_add(ob.m3_materialrefs, item_name=self.m3_string(m3_mat.name))
             mat = shared.m3_item_add(mat_col, item_name=matref.name)
 
-            processor = M3InputProcessor(self, mat, m3_mat)
-            io_shared.material_type_io_method[m3_matref.type](processor)
+            self.process_fields(io_shared.material_type_io_method[m3_matref.type], mat, m3_mat)
 
             matref.mat_type = shared.material_collections[m3_matref.type]
             matref.mat_handle = mat.bl_handle
@@ -969,14 +1234,13 @@ class Importer:
             elif m3_matref.type == 11:  # lens flare materials
                 for m3_starburst in self.m3[m3_mat.starbursts]:
                     starburst = shared.m3_item_add(mat.starbursts)
-                    processor = M3InputProcessor(self, starburst, m3_starburst)
-                    io_shared.io_starburst(processor)
+                    self.process_fields(io_shared.io_starburst, starburst, m3_starburst)
             elif m3_matref.type == 12:  # buffer (madd) materials
                 for schr in self.m3[m3_mat.texture_paths]:
                     m3_texture_path = self.m3[schr.path]
                     if m3_texture_path:
                         texture_path = mat.texture_paths.add()
-                        texture_path['name'] = self.m3[schr.path].content_to_string()
+                        texture_path['name'] = self.m3_string(schr.path)
 
             for layer_name in shared.material_type_to_layers[m3_matref.type]:
                 m3_layer_field = getattr(m3_mat, 'layer_' + layer_name, None)
@@ -989,7 +1253,7 @@ class Importer:
                     continue
 
                 m3_layer = self.m3[m3_layer_field][0]
-                m3_layer_bitmap_str = self.m3[m3_layer.color_bitmap].content_to_string() if m3_layer.color_bitmap.index else ''
+                m3_layer_bitmap_str = self.m3_string(m3_layer.color_bitmap) if m3_layer.color_bitmap.index else ''
                 if not m3_layer_bitmap_str and not m3_layer.bit_get('flags', 'color'):
                     continue
 
@@ -997,8 +1261,7 @@ class Importer:
 
                 layer = shared.m3_item_add(ob.m3_materiallayers, item_name=matref.name + '_' + layer_name)
                 layer.color_bitmap = m3_layer_bitmap_str
-                processor = M3InputProcessor(self, layer, m3_layer)
-                io_shared.io_material_layer(processor)
+                self.process_fields(io_shared.io_material_layer, layer, m3_layer)
 
                 layer.color_type = 'COLOR' if m3_layer.bit_get('flags', 'color') else 'BITMAP'
                 layer.fresnel_max = m3_layer.fresnel_min + m3_layer.fresnel_max_offset
@@ -1011,15 +1274,16 @@ class Importer:
                 layer_section_to_index[m3_layer_field.index] = len(ob.m3_materiallayers) - 1
                 setattr(mat, 'layer_' + layer_name, layer.bl_handle)
 
-        for matref, m3_matref in zip(ob.m3_materialrefs, self.m3[self.m3_model.material_references]):
+        for m3_matref_index in used_matref_indices:
+            m3_matref = m3_matrefs[m3_matref_index]
+            matref = ob.m3_materialrefs[self.matref_indices[m3_matref_index]]
             mat = shared.m3_pointer_get(getattr(self.ob, matref.mat_type), matref.mat_handle)
             m3_mat = self.m3[getattr(self.m3_model, shared.material_type_to_model_reference[m3_matref.type])][m3_matref.material_index]
             if m3_matref.type == 3:  # composite materials
                 for m3_section in self.m3[m3_mat.sections]:
                     section = shared.m3_item_add(mat.sections)
-                    section.material.handle = ob.m3_materialrefs[self.matref_index(m3_section.material_reference_index)].bl_handle
-                    processor = M3InputProcessor(self, section, m3_section)
-                    io_shared.io_material_composite_section(processor)
+                    section.material.handle = ob.m3_materialrefs[self.matref_indices[m3_section.material_reference_index]].bl_handle
+                    self.process_fields(io_shared.io_material_composite_section, section, m3_section)
 
     def create_mesh(self):
         ob = self.ob
@@ -1028,27 +1292,13 @@ class Importer:
             return
 
         self.m3_struct_version_set_from_ref('m3_mesh_version', self.m3_division.regions)
-        m3_vertices = self.m3[self.m3_model.vertices]
 
         v_colors = self.m3_model.bit_get('vertex_flags', 'color')
-        v_class_desc = io_m3.M3StructureDescription.get_vertex_description(self.m3_model.vertex_flags)
-        v_count = len(m3_vertices) // v_class_desc.size
-        m3_vertices = v_class_desc.instances(buffer=m3_vertices.raw_bytes, count=v_count)
         bone_lookup_full = self.m3[self.m3_model.bone_lookup]
 
-        if self.m3_model.bit_get('vertex_flags', 'skin0') and self.m3_model.bit_get('vertex_flags', 'skin1'):
-            get_lookup_weights = lambda x: (x.lookup0, x.lookup1, x.lookup2, x.lookup3, x.weight0, x.weight1, x.weight2, x.weight3)
-        elif self.m3_model.bit_get('vertex_flags', 'skin0') ^ self.m3_model.bit_get('vertex_flags', 'skin1'):
-            get_lookup_weights = lambda x: (x.lookup0, x.lookup1, x.weight0, x.weight1)
-        else:
-            get_lookup_weights = lambda x: ()
-
-        uv_props = []
-        for uv_prop in ['uv0', 'uv1', 'uv2', 'uv3', 'uv4']:
-            if v_class_desc.fields.get(uv_prop):
-                uv_props.append(uv_prop)
+        # vertex and face arrays of each region, with the vertex deduplication, unless a batch import worker prepared them
+        regions = self.preprocessed_regions or io_m3_batch.regions_prepare(self.m3, self.m3_model, self.m3_division)
 
-        m3_faces = self.m3[self.m3_division.faces]
         m3_batches = self.m3[self.m3_division.batches]
         self.m3_bl_ref[self.m3_division.regions.index] = {}
 
@@ -1058,34 +1308,47 @@ class Importer:
             if not region_batches:
                 continue
 
-            regn_m3_verts = m3_vertices[region.first_vertex_index:region.first_vertex_index + region.vertex_count]
-            regn_m3_faces = m3_faces[region.first_face_index:region.first_face_index + region.face_count]
+            regn_m3_verts, regn_m3_faces, regn_vert_indices, regn_vert_map = regions[region_ii]
             regn_uv_multiply = getattr(region, 'uv_multiply', 16)
             regn_uv_offset = getattr(region, 'uv_offset', 0)
 
-            if region.desc.version <= 2:
-                for ii in range(len(regn_m3_faces)):
-                    regn_m3_faces[ii] -= region.first_vertex_index
-
-            regn_m3_vert_ids = {}
-            regn_m3_vert_to_id = {}
-            regn_m3_verts_new = []
-
-            dups = 0
-            for ii, v in enumerate(regn_m3_verts):
-                id_tuple = (*to_bl_vec3(v.pos), *to_bl_vec3(v.normal), *get_lookup_weights(v))
-                regn_m3_vert_to_id[ii] = id_tuple
-                if regn_m3_vert_ids.get(id_tuple) is None:
-                    regn_m3_vert_ids[id_tuple] = ii - dups
-                    regn_m3_verts_new.append(v)
-                else:
-                    dups += 1
+            # vertex deduplication and welding results are stored as indices, so that they can be cached
+            region_cache = self.cache_data['regions'].get(region_ii) if self.cache_data is not None else None
+
+            if region_cache:
+                regn_vert_indices, regn_vert_map, regn_sharp_edges, regn_welds = region_cache
+            else:
+                regn_vert_indices, regn_vert_map = regn_vert_indices.tolist(), regn_vert_map.tolist()
+
+            regn_m3_verts_new = regn_m3_verts[regn_vert_indices]
+            regn_m3_faces = regn_m3_faces.tolist()
+
+            uv_props = [uv_prop for uv_prop in ('uv0', 'uv1', 'uv2', 'uv3', 'uv4') if uv_prop in regn_m3_verts.dtype.names]
+            regn_uvs = {uv_prop: to_np_uvs(regn_m3_verts[uv_prop], regn_uv_multiply, regn_uv_offset).tolist() for uv_prop in uv_props}
+
+            if v_colors:
+                regn_cols = np.stack([regn_m3_verts['col'][channel] / 255 for channel in 'rgb'] + [np.ones(len(regn_m3_verts))], axis=1).tolist()
+                regn_alphas = np.repeat(regn_m3_verts['col']['a'][:, None] / 255, 4, axis=1)
+                regn_alphas[:, 3] = 1
+                regn_alphas = regn_alphas.tolist()
+
+            # bone lookups and weights of each deduplicated vertex, lookups default to the first lookup of the region
+            regn_new_count = len(regn_m3_verts_new)
+            regn_new_weights = []
+            regn_new_lookups = []
+            for ii in range(0, region.vertex_lookups_used):
+                has_field = 'weight' + str(ii) in regn_m3_verts.dtype.names
+                regn_new_weights.append(regn_m3_verts_new['weight' + str(ii)].tolist() if has_field else [255] * regn_new_count)
+                regn_new_lookups.append(regn_m3_verts_new['lookup' + str(ii)].tolist() if has_field else [region.first_bone_lookup_index] * regn_new_count)
+
+            lookup_weight_fields = io_m3_batch.vertex_lookup_weight_fields(regn_m3_verts.dtype)
+            regn_new_lookup_ids = regn_m3_verts_new[lookup_weight_fields].tolist() if lookup_weight_fields else [()] * regn_new_count
 
             mesh = bpy.data.meshes.new('Mesh')
             mesh_ob = bpy.data.objects.new('Mesh', mesh)
             mesh_ob.parent = ob
 
-            bpy.context.scene.collection.objects.link(mesh_ob)
+            self.scene.collection.objects.link(mesh_ob)
 
             modifier = mesh_ob.modifiers.new('EdgeSplit', 'EDGE_SPLIT')
             modifier.use_edge_angle = False
@@ -1101,7 +1364,7 @@ class Importer:
 
             for batch in region_batches:
                 mesh_batch = shared.m3_item_add(mesh_ob.m3_mesh_batches)
-                mesh_batch.material.handle = ob.m3_materialrefs[self.matref_index(batch.material_reference_index)].bl_handle
+                mesh_batch.material.handle = ob.m3_materialrefs[self.matref_indices[batch.material_reference_index]].bl_handle
 
                 if batch.bone != -1:
                     pose_bone_name = self.m3_get_bone_name(batch.bone)
@@ -1117,118 +1380,127 @@ class Importer:
             for uv_prop in uv_props:
                 bm.loops.layers.uv.new(uv_prop)
 
-            vert_to_m3_vert = {}
-            for m3_vert in regn_m3_verts_new:
-                vert = bm.verts.new((m3_vert.pos.x, m3_vert.pos.y, m3_vert.pos.z))
+            for vert_index, pos in enumerate(regn_m3_verts_new['pos'].tolist()):
+                vert = bm.verts.new(pos)
 
-                vert_to_m3_vert[vert] = m3_vert
-
-                for ii in range(0, region.vertex_lookups_used):
-                    weight = getattr(m3_vert, 'weight' + str(ii), 255)
+                for weights, lookups in zip(regn_new_weights, regn_new_lookups):
+                    weight = weights[vert_index]
                     if weight:
-                        lookup_index = getattr(m3_vert, 'lookup' + str(ii), region.first_bone_lookup_index)
+                        lookup_index = lookups[vert_index]
                         vertex_groups_used[lookup_index] = True
                         vert[layer_deform][lookup_index] = weight / 255
 
             bm.verts.ensure_lookup_table()
+            bm.verts.index_update()
 
             for ii in range(0, len(regn_m3_faces), 3):
 
                 try:
-                    v0 = bm.verts[regn_m3_vert_ids.get(regn_m3_vert_to_id[regn_m3_faces[ii]])]
-                    v1 = bm.verts[regn_m3_vert_ids.get(regn_m3_vert_to_id[regn_m3_faces[ii + 1]])]
-                    v2 = bm.verts[regn_m3_vert_ids.get(regn_m3_vert_to_id[regn_m3_faces[ii + 2]])]
+                    v0 = bm.verts[regn_vert_map[regn_m3_faces[ii]]]
+                    v1 = bm.verts[regn_vert_map[regn_m3_faces[ii + 1]]]
+                    v2 = bm.verts[regn_vert_map[regn_m3_faces[ii + 2]]]
                     face = bm.faces.new((v0, v1, v2))
                     face.smooth = True
 
                     for jj in range(3):
-                        m3v = regn_m3_verts[regn_m3_faces[ii + jj]]
+                        m3v_index = regn_m3_faces[ii + jj]
                         loop = face.loops[jj]
                         for uv_prop in uv_props:
                             layer_uv = bm.loops.layers.uv.get(uv_prop)
-                            loop[layer_uv].uv = to_bl_uv(getattr(m3v, uv_prop), regn_uv_multiply, regn_uv_offset)
+                            loop[layer_uv].uv = regn_uvs[uv_prop][m3v_index]
                         if layer_color:
-                            loop[layer_color] = (m3v.col.r / 255, m3v.col.g / 255, m3v.col.b / 255, 1)
-                            loop[layer_alpha] = (m3v.col.a / 255, m3v.col.a / 255, m3v.col.a / 255, 1)
+                            loop[layer_color] = regn_cols[m3v_index]
+                            loop[layer_alpha] = regn_alphas[m3v_index]
                 except ValueError:
                     pass  # most likely to be duplicate or degenerate face
 
             bm.faces.ensure_lookup_table()
 
-            def get_matching_edge(origin, target):
-                for oedge in origin.link_edges:
-                    for tedge in target.link_edges:
-                        if len(set((tuple(oedge.verts[0].co), tuple(oedge.verts[1].co), tuple(tedge.verts[0].co), tuple(tedge.verts[1].co)))) == 2:
-                            return not tedge.smooth  # return False if the edge is smooth
-                return False
-
-            doubles = bmesh.ops.find_doubles(bm, verts=bm.verts, dist=0.00001)['targetmap']
-            for origin in list(doubles.keys()):
-                target = doubles[origin]
-
-                for edge in [*origin.link_edges, *target.link_edges]:
-                    if len(edge.link_faces) == 1:
+            if region_cache:
+                for v0, v1 in regn_sharp_edges:
+                    edge = bm.edges.get((bm.verts[v0], bm.verts[v1]))
+                    if edge:
                         edge.smooth = False
-
-            doubles_inverse = {}
-            for key in doubles:
-                try:
-                    doubles_inverse[doubles[key]].append(key)
-                except KeyError:
-                    doubles_inverse[doubles[key]] = [key]
-
-            point_lists = []
-            for key in doubles:
-                key_assigned = False
-                for plist in point_lists:
-                    if doubles[key] in plist:
-                        plist.append(key)
-                        key_assigned = True
-                        break
-                    elif doubles_inverse.get(key):
-                        for val in doubles_inverse[key]:
-                            if val in plist:
-                                plist.append(key)
-                                key_assigned = True
-                                break
-                if not key_assigned:
-                    point_lists.append([key, doubles[key]])
-
-            edge_match_dict = {}
-            for plist in point_lists:
-                for ii, origin in enumerate(plist):
-                    plist.pop(ii)
-                    edge_match_dict[origin] = {target: get_matching_edge(origin, target) for target in plist}
-                    plist.insert(ii, origin)
-
-            for origin in edge_match_dict:
-                for target in edge_match_dict[origin]:
-                    if not edge_match_dict[origin][target]:
-                        if doubles.get(origin) == target and doubles.get(target) != origin:
-                            common_keys = list(set(edge_match_dict[origin].keys()).intersection(edge_match_dict[target].keys()))
-                            common_dict = {key: edge_match_dict[target][key] for key in common_keys}
-                            if True not in common_dict.values():
-                                doubles.pop(origin, None)
-                        elif doubles.get(target) == origin and doubles.get(origin) != target:
-                            common_keys = list(set(edge_match_dict[origin].keys()).intersection(edge_match_dict[target].keys()))
-                            common_dict = {key: edge_match_dict[target][key] for key in common_keys}
-                            if True not in common_dict.values():
-                                doubles.pop(target, None)
-
-            for origin in list(doubles.keys()):
-                target = doubles[origin]
-
-                m3v0 = vert_to_m3_vert[origin]
-                m3v1 = vert_to_m3_vert[target]
-
-                m3v0_lookup_id = get_lookup_weights(m3v0)
-                m3v1_lookup_id = get_lookup_weights(m3v1)
-
-                if m3v0_lookup_id != m3v1_lookup_id:
+                doubles = {bm.verts[origin]: bm.verts[target] for origin, target in regn_welds}
+            else:
+                def get_matching_edge(origin, target):
+                    for oedge in origin.link_edges:
+                        for tedge in target.link_edges:
+                            if len(set((tuple(oedge.verts[0].co), tuple(oedge.verts[1].co), tuple(tedge.verts[0].co), tuple(tedge.verts[1].co)))) == 2:
+                                return not tedge.smooth  # return False if the edge is smooth
+                    return False
+
+                regn_sharp_edges = []
+                doubles = bmesh.ops.find_doubles(bm, verts=bm.verts, dist=0.00001)['targetmap']
+                for origin in list(doubles.keys()):
+                    target = doubles[origin]
+
+                    for edge in [*origin.link_edges, *target.link_edges]:
+                        if len(edge.link_faces) == 1:
+                            edge.smooth = False
+                            regn_sharp_edges.append((edge.verts[0].index, edge.verts[1].index))
+
+                doubles_inverse = {}
+                for key in doubles:
                     try:
-                        del doubles[origin]
+                        doubles_inverse[doubles[key]].append(key)
                     except KeyError:
-                        pass  # origin is somehow deleted sometimes?
+                        doubles_inverse[doubles[key]] = [key]
+
+                point_lists = []
+                for key in doubles:
+                    key_assigned = False
+                    for plist in point_lists:
+                        if doubles[key] in plist:
+                            plist.append(key)
+                            key_assigned = True
+                            break
+                        elif doubles_inverse.get(key):
+                            for val in doubles_inverse[key]:
+                                if val in plist:
+                                    plist.append(key)
+                                    key_assigned = True
+                                    break
+                    if not key_assigned:
+                        point_lists.append([key, doubles[key]])
+
+                edge_match_dict = {}
+                for plist in point_lists:
+                    for ii, origin in enumerate(plist):
+                        plist.pop(ii)
+                        edge_match_dict[origin] = {target: get_matching_edge(origin, target) for target in plist}
+                        plist.insert(ii, origin)
+
+                for origin in edge_match_dict:
+                    for target in edge_match_dict[origin]:
+                        if not edge_match_dict[origin][target]:
+                            if doubles.get(origin) == target and doubles.get(target) != origin:
+                                common_keys = list(set(edge_match_dict[origin].keys()).intersection(edge_match_dict[target].keys()))
+                                common_dict = {key: edge_match_dict[target][key] for key in common_keys}
+                                if True not in common_dict.values():
+                                    doubles.pop(origin, None)
+                            elif doubles.get(target) == origin and doubles.get(origin) != target:
+                                common_keys = list(set(edge_match_dict[origin].keys()).intersection(edge_match_dict[target].keys()))
+                                common_dict = {key: edge_match_dict[target][key] for key in common_keys}
+                                if True not in common_dict.values():
+                                    doubles.pop(target, None)
+
+                for origin in list(doubles.keys()):
+                    target = doubles[origin]
+
+                    m3v0_lookup_id = regn_new_lookup_ids[origin.index]
+                    m3v1_lookup_id = regn_new_lookup_ids[target.index]
+
+                    if m3v0_lookup_id != m3v1_lookup_id:
+                        try:
+                            del doubles[origin]
+                        except KeyError:
+                            pass  # origin is somehow deleted sometimes?
+
+                if self.cache_data is not None:
+                    regn_welds = [(origin.index, target.index) for origin, target in doubles.items()]
+                    self.cache_data['regions'][region_ii] = (regn_vert_indices, regn_vert_map, regn_sharp_edges, regn_welds)
+
             bmesh.ops.weld_verts(bm, targetmap=doubles)
 
             bm.to_mesh(mesh)
@@ -1253,7 +1525,7 @@ class Importer:
         for m3_point in self.m3[self.m3_model.attachment_points]:
             pose_bone_name = self.m3_get_bone_name(m3_point.bone)
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
-            point = shared.m3_item_add(ob.m3_attachmentpoints, item_name=self.m3[m3_point.name].content_to_string())
+            point = shared.m3_item_add(ob.m3_attachmentpoints, item_name=self.m3_string(m3_point.name))
             point.bone.handle = pose_bone.bl_handle if pose_bone else ''
 
             for m3_volume in m3_volumes:
@@ -1278,8 +1550,7 @@ class Importer:
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             light = shared.m3_item_add(ob.m3_lights, item_name=pose_bone_name)
             light.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            processor = M3InputProcessor(self, light, m3_light)
-            io_shared.io_light(processor)
+            self.process_fields(io_shared.io_light, light, m3_light)
 
     def create_shadow_boxes(self):
         if not hasattr(self.m3_model, 'shadow_boxes'):
@@ -1291,8 +1562,7 @@ class Importer:
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             shadow_box = shared.m3_item_add(ob.m3_shadowboxes, item_name=pose_bone_name)
             shadow_box.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            processor = M3InputProcessor(self, shadow_box, m3_shadow_box)
-            io_shared.io_shadow_box(processor)
+            self.process_fields(io_shared.io_shadow_box, shadow_box, m3_shadow_box)
 
     def create_cameras(self):
         ob = self.ob
@@ -1304,8 +1574,7 @@ class Importer:
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             camera = shared.m3_item_add(ob.m3_cameras, item_name=pose_bone_name)
             camera.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            processor = M3InputProcessor(self, camera, m3_camera)
-            io_shared.io_camera(processor)
+            self.process_fields(io_shared.io_camera, camera, m3_camera)
 
     def create_particles(self):
         ob = self.ob
@@ -1320,8 +1589,7 @@ class Importer:
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             copy = shared.m3_item_add(ob.m3_particlecopies, item_name=pose_bone_name)
             copy.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            processor = M3InputProcessor(self, copy, m3_copy)
-            io_shared.io_particle_copy(processor)
+            self.process_fields(io_shared.io_particle_copy, copy, m3_copy)
 
         system_handles = []
         prev_particles = len(ob.m3_particlesystems)
@@ -1332,10 +1600,9 @@ class Importer:
             system = shared.m3_item_add(ob.m3_particlesystems, item_name=pose_bone_name)
             system_handles.append(system.bl_handle)
             system.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            system.material.handle = ob.m3_materialrefs[self.matref_index(m3_system.material_reference_index)].bl_handle
+            system.material.handle = ob.m3_materialrefs[self.matref_indices[m3_system.material_reference_index]].bl_handle
 
-            processor = M3InputProcessor(self, system, m3_system)
-            io_shared.io_particle_system(processor)
+            self.process_fields(io_shared.io_particle_system, system, m3_system)
 
             if m3_system.bit_get('flags', 'tail_clamp'):
                 system.tail_type = 'CLAMP'
@@ -1382,7 +1649,7 @@ class Importer:
 
             m3_modelpaths = self.m3[m3_system.model_paths]
             if m3_modelpaths:  # it is only valid to have 1 path given
-                system.model_path = self.m3[m3_modelpaths[0].path].content_to_string()
+                system.model_path = self.m3_string(m3_modelpaths[0].path)
 
         for system, m3_system in zip(ob.m3_particlesystems[prev_particles:], m3_systems):
             system.collide_system.handle = system_handles[m3_system.collide_system] if m3_system.collide_system >= 0 else ''
@@ -1398,14 +1665,13 @@ class Importer:
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             ribbon = shared.m3_item_add(ob.m3_ribbons, item_name=pose_bone_name)
             ribbon.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            ribbon.material.handle = ob.m3_materialrefs[self.matref_index(m3_ribbon.material_reference_index)].bl_handle
-            processor = M3InputProcessor(self, ribbon, m3_ribbon)
-            io_shared.io_ribbon(processor)
+            ribbon.material.handle = ob.m3_materialrefs[self.matref_indices[m3_ribbon.material_reference_index]].bl_handle
+            self.process_fields(io_shared.io_ribbon, ribbon, m3_ribbon)
 
             if m3_ribbon.spline.index:
-                for ref in self.bl_ref_objects:
-                    if [m3_ribbon.spline.index] == ref['sections']:
-                        ribbon.spline.handle = ref['ob'].bl_handle
+                spline = self.bl_ref_objects.get((m3_ribbon.spline.index,))
+                if spline:
+                    ribbon.spline.handle = spline.bl_handle
                 else:
                     m3_spline = self.m3[m3_ribbon.spline]
                     spline = shared.m3_item_add(ob.m3_ribbonsplines, item_name=ribbon.name + '_spline')
@@ -1415,8 +1681,7 @@ class Importer:
                         pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
                         point = shared.m3_item_add(spline.points, item_name=pose_bone_name)
                         point.bone.handle = pose_bone.bl_handle if pose_bone else ''
-                        processor = M3InputProcessor(self, point, m3_point)
-                        io_shared.io_ribbon_spline(processor)
+                        self.process_fields(io_shared.io_ribbon_spline, point, m3_point)
                     self.m3_bl_ref[m3_ribbon.spline.index] = spline
 
     def create_projections(self):
@@ -1426,9 +1691,8 @@ class Importer:
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             projection = shared.m3_item_add(ob.m3_projections, item_name=pose_bone_name)
             projection.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            projection.material.handle = ob.m3_materialrefs[self.matref_index(m3_projection.material_reference_index)].bl_handle
-            processor = M3InputProcessor(self, projection, m3_projection)
-            io_shared.io_projection(processor)
+            projection.material.handle = ob.m3_materialrefs[self.matref_indices[m3_projection.material_reference_index]].bl_handle
+            self.process_fields(io_shared.io_projection, projection, m3_projection)
 
     def create_forces(self):
         ob = self.ob
@@ -1440,8 +1704,7 @@ class Importer:
             pose_bone = ob.data.bones.get(pose_bone_name)
             force = shared.m3_item_add(ob.m3_forces, item_name=pose_bone_name)
             force.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            processor = M3InputProcessor(self, force, m3_force)
-            io_shared.io_force(processor)
+            self.process_fields(io_shared.io_force, force, m3_force)
 
     def create_warps(self):
         ob = self.ob
@@ -1450,8 +1713,7 @@ class Importer:
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             warp = shared.m3_item_add(ob.m3_warps, item_name=pose_bone_name)
             warp.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            processor = M3InputProcessor(self, warp, m3_warp)
-            io_shared.io_warp(processor)
+            self.process_fields(io_shared.io_warp, warp, m3_warp)
 
     def create_hittests(self):
         ob = self.ob
@@ -1493,8 +1755,7 @@ class Importer:
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             rigidbody = shared.m3_item_add(ob.m3_rigidbodies, item_name=pose_bone_name)
             rigidbody.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            processor = M3InputProcessor(self, rigidbody, m3_rigidbody)
-            io_shared.io_rigid_body(processor)
+            self.process_fields(io_shared.io_rigid_body, rigidbody, m3_rigidbody)
 
             physics_shape = self.m3_bl_ref.get(m3_rigidbody.physics_shape.index)
             if physics_shape:
@@ -1542,8 +1803,7 @@ class Importer:
                 if pose_bone2 and rb.bone.handle == pose_bone2.bl_handle:
                     joint.rigidbody2.handle = rb.bl_handle
 
-            processor = M3InputProcessor(self, joint, m3_joint)
-            io_shared.io_rigid_body_joint(processor)
+            self.process_fields(io_shared.io_rigid_body_joint, joint, m3_joint)
 
             md = to_bl_matrix(m3_joint.matrix1).decompose()
             joint.location1 = md[0]
@@ -1583,13 +1843,12 @@ class Importer:
 
         for m3_cloth in self.m3[self.m3_model.physics_cloths]:
             cloth = shared.m3_item_add(ob.m3_cloths, item_name='Cloth')
-            processor = M3InputProcessor(self, cloth, m3_cloth)
-            io_shared.io_cloth(processor)
+            self.process_fields(io_shared.io_cloth, cloth, m3_cloth)
 
             if m3_cloth.constraints.index:
-                for ref in self.bl_ref_objects:
-                    if [m3_cloth.constraints.index] == ref['sections']:
-                        cloth.constraint_set.handle = ref['ob'].bl_handle
+                constraint_set = self.bl_ref_objects.get((m3_cloth.constraints.index,))
+                if constraint_set:
+                    cloth.constraint_set.handle = constraint_set.bl_handle
                 else:
                     m3_constraints = self.m3[m3_cloth.constraints]
                     constraint_set = shared.m3_item_add(ob.m3_clothconstraintsets, item_name=cloth.name + '_constraints')
@@ -1620,17 +1879,16 @@ class Importer:
 
             cloth_vertex_sim = self.m3[m3_cloth.vertex_simulated]
 
-            bpy.context.view_layer.objects.active = cloth.simulator_object
-            bpy.ops.object.mode_set(mode='EDIT')
             me = cloth.simulator_object.data
-            bm = bmesh.from_edit_mesh(me)
+            bm = bmesh.new()
+            bm.from_mesh(me)
 
             layer = bm.verts.layers.int.get('m3clothsim') or bm.verts.layers.int.new('m3clothsim')
             for vert in bm.verts:
                 vert[layer] = cloth_vertex_sim[vert.index]
 
-            bmesh.update_edit_mesh(me)
-            bpy.ops.object.mode_set(mode='OBJECT')
+            bm.to_mesh(me)
+            bm.free()
 
     def create_ik_joints(self):
         ob = self.ob
@@ -1650,8 +1908,7 @@ class Importer:
                     joint_length += 1
                 ik.joint_length = joint_length
 
-            processor = M3InputProcessor(self, ik, m3_ik)
-            io_shared.io_ik(processor)
+            self.process_fields(io_shared.io_ik, ik, m3_ik)
 
     def create_turrets(self):
         ob = self.ob
@@ -1673,15 +1930,14 @@ class Importer:
         self.m3_struct_version_set_from_ref('m3_turrets_part_version', self.m3_model.turret_parts)
 
         for m3_turret in self.m3[self.m3_model.turrets]:
-            turret = shared.m3_item_add(ob.m3_turrets, item_name=self.m3[m3_turret.name].content_to_string())
+            turret = shared.m3_item_add(ob.m3_turrets, item_name=self.m3_string(m3_turret.name))
             for ii in self.m3[m3_turret.parts]:
                 m3_part = self.m3[self.m3_model.turret_parts][ii]
                 pose_bone_name = self.m3_get_bone_name(m3_part.bone)
                 pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
                 part = shared.m3_item_add(turret.parts, item_name=pose_bone_name)
                 part.bone.handle = pose_bone.bl_handle if pose_bone else ''
-                processor = M3InputProcessor(self, part, m3_part)
-                io_shared.io_turret_part(processor)
+                self.process_fields(io_shared.io_turret_part, part, m3_part)
 
                 part['main_part'] = m3_part.bit_get('flags', 'main_part')
                 part['group_id'] = m3_part.group_id
@@ -1705,8 +1961,7 @@ class Importer:
             pose_bone = ob.pose.bones.get(pose_bone_name) if pose_bone_name else None
             billboard = shared.m3_item_add(ob.m3_billboards, item_name=pose_bone_name)
             billboard.bone.handle = pose_bone.bl_handle if pose_bone else ''
-            processor = M3InputProcessor(self, billboard, m3_billboard)
-            io_shared.io_billboard(processor)
+            self.process_fields(io_shared.io_billboard, billboard, m3_billboard)
 
             billboard.up = to_bl_quat(m3_billboard.up).to_euler('XYZ')
             billboard.forward = to_bl_quat(m3_billboard.forward).to_euler('XYZ')
@@ -1715,8 +1970,7 @@ class Importer:
         ob = self.ob
         for m3_tmd in self.m3[self.m3_model.tmd_data]:
             tmd = shared.m3_item_add(ob.m3_tmd, item_name='TMD')
-            processor = M3InputProcessor(self, tmd, m3_tmd)
-            io_shared.io_tmd(processor)
+            self.process_fields(io_shared.io_tmd, tmd, m3_tmd)
 
             for m3_vec in self.m3[m3_tmd.vectors]:
                 vec_item = shared.m3_item_add(tmd.vectors, item_name='Vector')
@@ -1727,9 +1981,9 @@ class Importer:
         if not (m3_vert_ref.index and m3_vert_ref.entries and m3_face_ref.index and m3_face_ref.entries):
             return
 
-        for ref in self.bl_ref_objects:
-            if [m3_vert_ref.index, m3_face_ref.index] == ref['sections']:
-                return ref['ob']
+        ref_sections = (m3_vert_ref.index, m3_face_ref.index)
+        if ref_sections in self.bl_ref_objects:
+            return self.bl_ref_objects[ref_sections]
 
         me = bpy.data.meshes.new(name)
         me_ob = bpy.data.objects.new(me.name, me)
@@ -1737,19 +1991,15 @@ class Importer:
         me_ob.parent = self.ob
         me_ob.hide_render = True
         me_ob.m3_mesh_export = False
-        bpy.context.scene.collection.objects.link(me_ob)
+        self.scene.collection.objects.link(me_ob)
 
-        bl_vert_data = []
-        for v in self.m3[m3_vert_ref]:
-            bl_vert_data.append(v.x)
-            bl_vert_data.append(v.y)
-            bl_vert_data.append(v.z)
+        bl_vert_data = to_np_array(self.m3[m3_vert_ref], '<f4', ('x', 'y', 'z'))
 
         m3_face_data = self.m3[m3_face_ref].content
         bl_tri_range = range(0, len(m3_face_data), 3)
 
-        me.vertices.add(round(len(bl_vert_data) / 3))
-        me.vertices.foreach_set('co', bl_vert_data)
+        me.vertices.add(len(bl_vert_data))
+        me.vertices.foreach_set('co', bl_vert_data.ravel())
         me.loops.add(len(m3_face_data))
         me.loops.foreach_set('vertex_index', m3_face_data)
         me.polygons.add(len(bl_tri_range))
@@ -1759,7 +2009,7 @@ class Importer:
         me.validate()
         me.update(calc_edges=True)
 
-        self.bl_ref_objects.append({'sections': [m3_vert_ref.index, m3_face_ref.index], 'ob': me_ob})
+        self.bl_ref_objects[ref_sections] = me_ob
 
         return me_ob
 
@@ -1768,9 +2018,9 @@ class Importer:
         if not (m3_vert_ref.index and m3_vert_ref.entries and m3_loop_ref.index and m3_loop_ref.entries and m3_poly_ref.index and m3_poly_ref.entries):
             return
 
-        for ref in self.bl_ref_objects:
-            if [m3_vert_ref.index, m3_loop_ref.index, m3_poly_ref] == ref['sections']:
-                return ref['ob']
+        ref_sections = (m3_vert_ref.index, m3_loop_ref.index, m3_poly_ref.index)
+        if ref_sections in self.bl_ref_objects:
+            return self.bl_ref_objects[ref_sections]
 
         me = bpy.data.meshes.new(name)
         me_ob = bpy.data.objects.new(me.name, me)
@@ -1778,57 +2028,142 @@ class Importer:
         me_ob.parent = self.ob
         me_ob.hide_render = True
         me_ob.m3_mesh_export = False
-        bpy.context.scene.collection.objects.link(me_ob)
-
-        bl_vert_data = []
-        for v in self.m3[m3_vert_ref]:
-            bl_vert_data.extend((v.x, v.y, v.z))
-
-        bl_loop_data = self.m3[m3_loop_ref].content
-        bl_poly_data = self.m3[m3_poly_ref].content
-
-        loop_indices = {ii: [] for ii in bl_poly_data}
-        bl_loop_data_ordered = []
-        for ii in bl_poly_data:
-            loop_index = ii
-            while loop_index not in loop_indices[ii]:
-                loop_indices[ii].append(loop_index)
-                bl_loop_data_ordered.append(bl_loop_data[loop_index].vertex)
-                loop_index = bl_loop_data[loop_index].loop
-
-        bl_loop_start_ordered = []
-        num = 0
-        for ii in loop_indices:
-            bl_loop_start_ordered.append(num)
-            num += len(loop_indices[ii])
-
-        me.vertices.add(len(bl_vert_data) // 3)
-        me.vertices.foreach_set('co', bl_vert_data)
-        me.loops.add(len(bl_loop_data))
-        me.loops.foreach_set('vertex_index', [ii for ii in bl_loop_data_ordered])
-        me.polygons.add(len(bl_poly_data))
-        me.polygons.foreach_set('loop_start', [ii for ii in bl_loop_start_ordered])
-        me.polygons.foreach_set('loop_total', [len(loop_indices[ii]) for ii in bl_poly_data])
+        self.scene.collection.objects.link(me_ob)
+
+        bl_vert_data = to_np_array(self.m3[m3_vert_ref], '<f4', ('x', 'y', 'z'))
+        m3_loops = to_np_array(self.m3[m3_loop_ref], np.uint8, ('unknown00', 'vertex', 'polygon', 'loop')).astype(np.int64)
+        poly_loop_starts = to_np_array(self.m3[m3_poly_ref], np.uint8).astype(np.int64)
+        loop_vertices = m3_loops[:, 1]
+        loop_nexts = m3_loops[:, 3]
+
+        # each polygon is a chain of loops linked by their loop field, which all polygons follow at the same time
+        # until reaching a loop already visited by the polygon, tracked in a bitmap of visited loops per polygon
+        poly_range = np.arange(len(poly_loop_starts))
+        visited = np.zeros((len(poly_loop_starts), len(m3_loops)), dtype=bool)
+        active = np.ones(len(poly_loop_starts), dtype=bool)
+        loop_indices = poly_loop_starts.copy()
+        poly_chains = []
+        while active.any():
+            poly_chains.append(np.where(active, loop_indices, -1))
+            visited[poly_range[active], loop_indices[active]] = True
+            loop_indices[active] = loop_nexts[loop_indices[active]]
+            active &= ~visited[poly_range, loop_indices]
+
+        poly_chains = np.stack(poly_chains, axis=1) if poly_chains else np.zeros((0, 0), dtype=np.int64)
+        poly_chains_used = poly_chains != -1
+        bl_loop_data_ordered = loop_vertices[poly_chains[poly_chains_used]]
+        bl_loop_total = poly_chains_used.sum(axis=1)
+        bl_loop_start_ordered = np.cumsum(bl_loop_total) - bl_loop_total
+
+        me.vertices.add(len(bl_vert_data))
+        me.vertices.foreach_set('co', bl_vert_data.ravel())
+        me.loops.add(len(bl_loop_data_ordered))
+        me.loops.foreach_set('vertex_index', bl_loop_data_ordered.astype(np.int32))
+        me.polygons.add(len(poly_loop_starts))
+        me.polygons.foreach_set('loop_start', bl_loop_start_ordered.astype(np.int32))
+        me.polygons.foreach_set('loop_total', bl_loop_total.astype(np.int32))
 
         me.validate()
         me.update(calc_edges=True)
 
-        self.bl_ref_objects.append({'sections': [m3_vert_ref.index, m3_loop_ref.index, m3_poly_ref], 'ob': me_ob})
+        self.bl_ref_objects[ref_sections] = me_ob
 
         return me_ob
 
 
-def m3_import(filepath, ob=None, bl_op=None, opts=None):
-    importer = Importer(bl_op)
+def m3_import_run(importer, filepath, ob=None, opts=None, cache=None):
+    tracemalloc_started = importer.stage_stats is not None and not tracemalloc.is_tracing()
+    if tracemalloc_started:
+        tracemalloc.start()
     try:
-        if ob and filepath.endswith('.m3a'):
-            importer.m3a_import(filepath, ob)
-        elif ob:
-            importer.m3_import(filepath, ob, opts=opts)
-        else:
-            importer.m3_import(filepath, ob)
+        with shared.m3_item_names_indexed():
+            if ob and filepath.endswith('.m3a'):
+                importer.m3a_import(filepath, ob)
+            elif ob:
+                importer.m3_import(filepath, ob, opts=opts, cache=cache)
+            else:
+                importer.m3_import(filepath, ob, cache=cache)
     except Exception as e:
         if type(e) != AssertionError:
             importer.exception_trace = traceback.format_exc()
+    finally:
+        if tracemalloc_started:
+            tracemalloc.stop()
+        if importer.m3 is not None:
+            importer.m3.close()
+
+
+def m3_import(filepath, ob=None, bl_op=None, opts=None, profile=False, cache=None):
+    importer = Importer(bl_op, profile=profile)
+    try:
+        m3_import_run(importer, filepath, ob, opts, cache)
     finally:
         importer.do_report()
+
+    return importer.stage_stats
+
+
+def m3_import_headless(filepath, scene=None, ob=None, opts=None, profile=True, cache=None):
+    '''
+    Imports an m3 or m3a file without relying on the user interface, for use in background Blender sessions,
+    such as those started with blender -b --python.
+
+    filepath: path of the .m3 or .m3a file. An .m3a file is only imported when ob is given.
+    scene: scene which new objects are linked to, defaulting to the scene of the context.
+    ob: existing armature object to import into, otherwise a new armature object is created.
+    opts: tuple of (rig, animations, mesh, effects) booleans, which applies only to m3 import into an existing object.
+    profile: collects time, memory and data-block statistics for each stage of the import.
+    cache: ImportCache instance to read and store preprocessed import data, or None.
+
+    Nothing is selected, made active or reported. Instead, a dict is returned with these keys:
+    filepath, object (the armature object, or None if creating it failed), warnings (list of strings),
+    error (traceback string, or None), time (seconds) and stages (list of stage statistics dicts, or None).
+    '''
+    importer = Importer(profile=profile, scene=scene, headless=True)
+    time_start = time.perf_counter()
+    m3_import_run(importer, filepath, ob, opts, cache)
+
+    return {
+        'filepath': filepath,
+        'object': getattr(importer, 'ob', None),
+        'warnings': importer.warn_strings,
+        'error': importer.exception_trace or None,
+        'time': time.perf_counter() - time_start,
+        'stages': importer.stage_stats,
+    }
+
+
+def m3_import_batch(filepaths, bl_op=None, max_workers=None):
+    for filepath in filepaths:
+        if not filepath.lower().endswith('.m3'):
+            warning = f'{filepath} is not an m3 file and was not imported'
+            print(warning)  # not for debugging
+            if bl_op:
+                bl_op.report({"WARNING"}, warning)
+
+    filepaths = [filepath for filepath in filepaths if filepath.lower().endswith('.m3')]
+
+    # workers prepare the vertex, face and key arrays of each file, which do not depend on blender
+    # the main process reads everything else from its own lazy load of the file
+    # workers are spawned rather than forked, since blender holds a gpu context and threads which must not be copied
+    batch_module = io_m3_batch.module_load(io_m3_batch.worker_module_name, io_m3_batch.__file__)
+    mp_context = multiprocessing.get_context('spawn')
+    initargs = (io_m3_batch.__file__, None, io_m3_batch.worker_init_run_name)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context, initializer=runpy.run_path, initargs=initargs) as executor:
+        futures = [executor.submit(batch_module.file_preprocess, filepath) for filepath in filepaths]
+
+        # blender data can only be created from the main thread, so objects are built in the order files were given
+        for filepath, future in zip(filepaths, futures):
+            importer = Importer(bl_op)
+            try:
+                preprocessed = future.result()
+                with shared.m3_item_names_indexed():
+                    importer.m3_import(filepath, preprocessed=preprocessed)
+            except Exception as e:
+                if type(e) != AssertionError:
+                    importer.exception_trace = traceback.format_exc()
+            finally:
+                if importer.m3 is not None:
+                    importer.m3.close()
+                importer.do_report()
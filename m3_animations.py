@@ -68,12 +68,27 @@ def ob_anim_data_set(scene, ob, new_action=None):
         scene.frame_set(0)
 
 
-# this function is exported to io_m3_import.py
 def set_default_value(action, path, index, value):
     fcurve = action.fcurves.find(path, index=index) or action.fcurves.new(path, index=index)
     fcurve.keyframe_points.insert(0, value)
 
 
+# this function is exported to io_m3_import.py
+def set_default_values(action, path_index_values):
+    # bulk equivalent of set_default_value, where path_index_values maps (path, index) pairs to values
+    fcurve_index = {(fcurve.data_path, fcurve.array_index): fcurve for fcurve in action.fcurves}
+
+    for (path, index), value in path_index_values.items():
+        fcurve = fcurve_index.get((path, index))
+        if fcurve is not None:
+            fcurve.keyframe_points.insert(0, value)
+        else:
+            fcurve = action.fcurves.new(path, index=index)
+            fcurve.keyframe_points.add(1)
+            fcurve.keyframe_points.foreach_set('co', (0.0, float(value)))
+            fcurve.update()
+
+
 def anim_update(self, context):
     if context.object and context.object.m3_options.update_anim_data:
         anim = None
@@ -245,6 +245,7 @@ class M3MaterialLayerOpRemove(bpy.types.Operator):
             return {'CANCELLED'}
 
         ob.m3_materiallayers.remove(ob.m3_materiallayers_index)
+        shared.m3_handle_indices_invalidate()
 
         shared.remove_m3_action_keyframes(ob, 'm3_materiallayers', ob.m3_materiallayers_index)
         for ii in range(ob.m3_materiallayers_index, len(ob.m3_materiallayers)):
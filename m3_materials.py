@@ -879,6 +879,7 @@ class M3MaterialOpRemove(bpy.types.Operator):
                 break
 
         ob.m3_materialrefs.remove(ob.m3_materialrefs_index)
+        shared.m3_handle_indices_invalidate()
 
         shared.remove_m3_action_keyframes(ob, matref.mat_type, mat_ii)
         for ii in range(mat_ii, len(matrefs)):
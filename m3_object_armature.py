@@ -45,6 +45,11 @@ class ExportOptionsGroup(bpy.types.PropertyGroup):
     cull_unused_bones: bpy.props.BoolProperty(default=True, name='Cull Unused Bones', description='Bones which the exporter determines will not be referenced in the m3 file are removed')
     cull_material_layers: bpy.props.BoolProperty(default=True, name='Cull Material Layers', description='Fills all blank material layer slots with a reference to a single layer section, which reduces file size. When turned off, output will conform to Blizzard standards, where all available material layer slots are filled with a unique layer section.')
     use_only_max_bounds: bpy.props.BoolProperty(default=False, name='Use Only Max Bounds', description='Rather than having multiple bounding box keys, animations will have exactly one bounding box key which has the maximum dimensions of all the keys there would have been. Can slightly reduce file size')
+    smooth_tangents: bpy.props.BoolProperty(default=False, name='Smooth Tangents', description='Tangents of vertices are averaged from all of the faces which share them and made perpendicular to the vertex normal, rather than being taken from a single face. Can improve the shading of normal maps on curved surfaces')
+    sample_fcurves: bpy.props.BoolProperty(default=False, name='Sample F-Curves', description='Bone animations are read directly from the f-curves of each action rather than by evaluating the scene on every frame, which is much faster. Bones which have constraints or drivers, are part of an inverse kinematics chain, are connected, do not use quaternion rotation or do not fully inherit the transform of their parent are still evaluated through the scene')
+    anim_error_location: bpy.props.FloatProperty(default=0.0005, min=0, precision=4, name='Location Error', description='Bone animation keys are removed where the location can be interpolated from the remaining keys without differing by more than this distance. Keyframes set by the user are always kept')
+    anim_error_rotation: bpy.props.FloatProperty(default=0.0002, min=0, precision=4, subtype='ANGLE', name='Rotation Error', description='Bone animation keys are removed where the rotation can be interpolated from the remaining keys without differing by more than this angle. Keyframes set by the user are always kept')
+    anim_error_scale: bpy.props.FloatProperty(default=0.0005, min=0, precision=4, name='Scale Error', description='Bone animation keys are removed where the scale can be interpolated from the remaining keys without differing by more than this amount. Keyframes set by the user are always kept')
 
 
 def register_props():
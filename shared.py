@@ -18,6 +18,8 @@
 
 import bpy
 import random
+import contextlib
+from bpy.app.handlers import persistent
 from . import bl_enum
 
 
@@ -112,8 +114,100 @@ def m3_anim_id_gen():
     return hex(num)[2:]
 
 
+# maps (id data pointer, collection path) to an M3ItemNameIndex while m3_item_names_indexed is active
+m3_item_name_indices = None
+
+
+class M3ItemNameIndex:
+
+    def __init__(self, collection):
+        self.name_counts = {}
+        # prefix -> suffix number from which searching for an unused name can resume
+        self.num_hints = {}
+        for item in collection:
+            self.add(item.name)
+
+    def __contains__(self, name):
+        return name in self.name_counts
+
+    def add(self, name):
+        self.name_counts[name] = self.name_counts.get(name, 0) + 1
+
+    def remove(self, name):
+        count = self.name_counts.get(name, 0) - 1
+        if count > 0:
+            self.name_counts[name] = count
+            return
+
+        self.name_counts.pop(name, None)
+
+        # a freed name invalidates the hints of any prefix it could have been generated from
+        self.num_hints.pop(name, None)
+        head, sep, tail = name.rpartition(' ')
+        if sep and tail.isdigit():
+            self.num_hints.pop(head, None)
+        if name.isdigit():
+            self.num_hints.pop('', None)
+
+
+@contextlib.contextmanager
+def m3_item_names_indexed():
+    # names are indexed per collection for the duration of the block, which must not remove or rename items other than through m3_item_* functions
+    global m3_item_name_indices
+    if m3_item_name_indices is not None:
+        yield
+        return
+
+    m3_item_name_indices = {}
+    try:
+        yield
+    finally:
+        m3_item_name_indices = None
+
+
+def m3_item_name_index_get(collection, new_item=None):
+    if m3_item_name_indices is None:
+        return None
+
+    key = (collection.id_data.as_pointer(), collection.path_from_id())
+
+    try:
+        name_index = m3_item_name_indices[key]
+    except KeyError:
+        item = new_item or (collection[0] if len(collection) else None)
+        if item is None:
+            return None
+
+        # names provided by a getter can change without the index knowing
+        for clss in type(item).__mro__:
+            name_prop = clss.__dict__.get('__annotations__', {}).get('name')
+            if name_prop is not None:
+                break
+        if 'get' in getattr(name_prop, 'keywords', {}):
+            name_index = None
+        else:
+            name_index = M3ItemNameIndex(collection)
+
+        m3_item_name_indices[key] = name_index
+        return name_index
+
+    if name_index is not None and new_item is not None:
+        name_index.add(new_item.name)
+
+    return name_index
+
+
+def m3_item_name_set(collection, item, name):
+    name_index = m3_item_name_index_get(collection)
+    if name_index is not None:
+        name_index.remove(item.name)
+        name_index.add(name)
+    item['name'] = name
+
+
 def m3_item_get_name(collection, prefix='', suggest=True):
-    used_names = {item.name for item in collection}
+    name_index = m3_item_name_index_get(collection)
+    used_names = name_index if name_index is not None else {item.name for item in collection}
 
     if prefix not in used_names:
         return prefix
@@ -130,17 +224,37 @@ def m3_item_get_name(collection, prefix='', suggest=True):
 
     name = prefix
     num = 1
+
+    if name_index is not None and prefix in name_index.num_hints:
+        num = name_index.num_hints[prefix]
+        name = prefix + (' ' if prefix else '') + ('0' if num < 10 else '') + str(num)
+        num += 1
+
     while True:
         if name not in used_names:
+            if name_index is not None:
+                name_index.num_hints[prefix] = num
             return name
         name = prefix + (' ' if prefix else '') + ('0' if num < 10 else '') + str(num)
         num += 1
 
 
+# incremented whenever animation ids are set, or items of m3 collections are removed or moved
+m3_collections_generation = 0
+
+
+@persistent
+def m3_collections_changed(*args):
+    global m3_collections_generation
+    m3_collections_generation += 1
+
+
 def m3_item_add(collection, item_name=''):
     item = collection.add()
     item['bl_handle'] = m3_handle_gen()
-    item['name'] = m3_item_get_name(collection, item_name)
+    m3_handle_indices_invalidate()
+    m3_item_name_index_get(collection, new_item=item)
+    m3_item_name_set(collection, item, m3_item_get_name(collection, item_name))
 
     for key in type(item).__annotations__.keys():
         prop = getattr(item, key)
@@ -166,7 +280,11 @@ def m3_item_duplicate(collection, src, dup_action_keyframes, dst_collection=None
     dst = m3_item_add(dst_collection)
 
     if (type(dst) != type(src)):
+        name_index = m3_item_name_index_get(dst_collection)
+        if name_index is not None:
+            name_index.remove(dst.name)
         collection.remove(len(collection) - 1)
+        m3_handle_indices_invalidate()
         return None
 
     dup_actions = []
@@ -220,8 +338,8 @@ def m3_item_duplicate(collection, src, dup_action_keyframes, dst_collection=None
                     dst_fcurve.keyframe_points.foreach_set('interpolation', src_interps)
                     dst_fcurve.keyframe_points.foreach_set('type', src_types)
 
-    dst['name'] = ''
-    dst['name'] = m3_item_get_name(dst_collection, src.name if not src.name.isdigit() else '', suggest=False)
+    m3_item_name_set(dst_collection, dst, '')
+    m3_item_name_set(dst_collection, dst, m3_item_get_name(dst_collection, src.name if not src.name.isdigit() else '', suggest=False))
 
     if dup_action_keyframes:
         # for some reason fcurve values are only properly displayed once animation view is updated manually
@@ -239,14 +357,58 @@ def m3_collection_index_set(bl, value):
         setattr(ob.path_resolve(rsp[0]), rsp[1] + '_index', value)
 
 
+# maps (id data pointer, collection path) to [generation, length, {handle: index}], see m3_pointer_get
+m3_handle_indices = {}
+m3_handle_generation = 0
+
+
+@persistent
+def m3_handle_indices_invalidate(*args):
+    # called when handles may have changed, including when items are added or removed
+    global m3_handle_generation
+    m3_handle_generation += 1
+    m3_handle_indices.clear()
+
+
 def m3_pointer_get(search_data, pointer):
     handle = pointer.handle if type(pointer) != str else pointer
     if not handle:
         return None
-    for item in search_data:
-        if item.bl_handle == handle:
-            return item
-    return None
+
+    if not isinstance(search_data, bpy.types.bpy_prop_collection):
+        for item in search_data:
+            if item.bl_handle == handle:
+                return item
+        return None
+
+    key = (search_data.id_data.as_pointer(), search_data.path_from_id())
+    search_data_len = len(search_data)
+
+    # indices are only trusted once the item found at them is confirmed to have the handle,
+    # and misses are only trusted if the collection has not changed length since indexing
+    handle_index = m3_handle_indices.get(key)
+    if handle_index is not None and handle_index[0] == m3_handle_generation:
+        ii = handle_index[2].get(handle)
+        if ii is None:
+            if handle_index[1] == search_data_len:
+                return None
+        elif ii < search_data_len:
+            item = search_data[ii]
+            if item.bl_handle == handle:
+                return item
+
+    handles = {}
+    found_item = None
+    for ii, item in enumerate(search_data):
+        item_handle = item.bl_handle
+        if item_handle not in handles:
+            handles[item_handle] = ii
+            if item_handle == handle:
+                found_item = item
+
+    m3_handle_indices[key] = [m3_handle_generation, search_data_len, handles]
+
+    return found_item
 
 
 def select_bones_handles(ob, pointers):
@@ -415,6 +577,7 @@ def hex_id_get(self):
 
 
 def hex_id_set(self, value):
+    m3_collections_changed()
     try:
         self['hex_id'] = hex(int(value, 16))[2:]
     except ValueError:
@@ -488,6 +651,8 @@ class M3CollectionOpRemove(M3CollectionOpBase):
             return {'FINISHED'}
 
         collection.remove(self.index)
+        m3_collections_changed()
+        m3_handle_indices_invalidate()
 
         remove_m3_action_keyframes(context.object, self.collection, self.index)
         for ii in range(self.index, len(collection)):
@@ -508,6 +673,7 @@ class M3CollectionOpMove(M3CollectionOpBase):
 
         if (self.index < len(collection) - self.shift and self.index >= -self.shift):
             collection.move(self.index, self.index + self.shift)
+            m3_collections_changed()
             swap_m3_action_keyframes(context.object, self.collection, self.index, self.index + self.shift)
             m3_collection_index_set(collection, self.index + self.shift)
 
@@ -528,6 +694,7 @@ class M3CollectionOpDuplicate(M3CollectionOpBase):
             return {'FINISHED'}
 
         m3_item_duplicate(collection, collection[self.index], self.dup_action_keyframes)
+        m3_handle_indices_invalidate()
         m3_collection_index_set(collection, len(collection) - 1)
 
         return {'FINISHED'}
@@ -552,6 +719,7 @@ class M3HandleListOpRemove(M3CollectionOpBase):
 
     def invoke(self, context, event):
         context.object.path_resolve(self.collection).remove(self.index)
+        m3_handle_indices_invalidate()
         return {'FINISHED'}
 
 
@@ -560,6 +728,7 @@ def m3_data_handles_verify(data):
     for item in data:
         if not item.bl_handle or item.bl_handle in handles:
             item.bl_handle = m3_handle_gen()
+            m3_handle_indices_invalidate()
         handles.add(item.bl_handle)
 
 